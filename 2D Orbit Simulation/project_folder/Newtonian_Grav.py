@@ -1,5 +1,7 @@
+import numpy as np
 from mass import *
 import helper_functions
+import collisions
 
   
 """
@@ -8,22 +10,32 @@ each Mass instance created in the Main class, then updating each mass's data
 structures for the next calculation. """
 class Gravitation:
 
-    time_step = 3000                 # Default 5000 seconds per frame 
+    time_step = 3000                 # Default 3000 seconds per frame 
+    max_time_step = 3000             # Largest step the first order update below stays stable at
 
     # Initialising class so class instances can be made and its 
     # methods and attrbutes accessed
     def __init__(self,main):
-        assert Gravitation.time_step > 0 and Gravitation.time_step <= 10**4
-        assert abs(self.time_step) <= 3000
         self.main = main
+        self.time_step = main.TIME_STEP
+        assert self.time_step > 0 and self.main.SUB_STEPS >= 1
+        assert abs(self.time_step/self.main.SUB_STEPS) <= self.max_time_step, \
+            "TIME_STEP/SUB_STEPS above %g s, the largest %s allows" % (self.max_time_step, self.main.INTEGRATOR)
         assert self.main.TIME_LAPSE >=0 and self.main.TIME_LAPSE <= 1
         self.current_system = main.input
         self.initialise_data_structures()
         
     def initialise_data_structures(self):
-        self.map, self.p_total = {}, []
-        self.dT = Gravitation.time_step*self.main.TIME_LAPSE
+        self.map, self.p_total = {}, []     # p_total: total momentum at the latest diagnostics sample
+        self.frame_dT = self.time_step*self.main.TIME_LAPSE     # Simulated time per rendered frame
+        self.dT = self.frame_dT/self.main.SUB_STEPS              # Simulated time per (sub-)step
         self.removed, self.rem_ids, self.new_ids, self.new_system = [],[],[],[]
+        self.merges = []
+        self.counters = {"force_evaluations": 0, "force_pairs": 0, "collision_checks": 0,
+                         "candidate_pairs": 0, "colliding_pairs": 0, "merges": 0, "array_rebuilds": 0}
+        self.monitor = None              # diagnostics.Conservation told of merges, removals and additions
+        self.potential_wanted = False    # True while a diagnostics sample wants the potential energy
+        self.journal = None              # journal.Journal every injected mass is logged to
 
     
     # ________________________ Methods for calculating object positions
@@ -71,6 +83,8 @@ class Gravitation:
     # 5. Calculating the acceleration vector of current object due to gravitational force 
     # exerted by surrounding objects
     def g_vectors(self):
+        self.counters["force_evaluations"] += 1
+        self.counters["force_pairs"] += len(self.current_system)*(len(self.current_system) - 1)
         for n in self.current_system:
             result = []
             if len(n.others) > 0:
@@ -122,88 +136,103 @@ class Gravitation:
         
                 
     # __________________The following methods deal with collisions and momentum transfer: 
+    # Positions, velocities and diameters of the system, the arrays collision detection reads
+    def collision_arrays(self):
+        system = self.current_system
+        s = np.array([n.s for n in system], dtype=float).reshape(-1,2)
+        v = np.array([n.v for n in system], dtype=float).reshape(-1,2)
+        diameter = np.array([n.real_diameter for n in system], dtype=float)
+        return s, v, diameter
+
     # 9. The following method will allow the the machine to differentiate between 
-    #    collided masses and other masses. 
+    #    collided masses and other masses. Colliding masses are found with a sweep and
+    #    prune over the system and grouped into independent clusters (see collisions.py).
+    #    Returns the clusters, as lists of Mass instances, and the masses left untouched.
     def remove_collided(self):
-        removed,new = [],[]
-        for n in self.current_system:
-            for distance in n.r_mag:
-                ind = n.r_mag.index(distance)
-                size_other = n.others[ind].real_diameter
-                gRx, gRy= 0,0
-                vf_x = abs(n.v[0]) + abs(n.others[ind].v[0]) + gRx*self.dT  
-                vf_y = abs(n.v[1]) + abs(n.others[ind].v[1]) + gRy*self.dT
-                vf_mag = (vf_x**2 +vf_y**2)**0.5                             
-                deletion_dist = (0.5*n.real_diameter + 0.5*size_other)
-                LIMIT = deletion_dist + vf_mag*self.dT
-                if distance <= LIMIT: 
-                    removed.append(n) 
-                    n.gR=[0,0]
-            if n in removed: continue
-            else: new.append(n)  
+        self.counters["collision_checks"] += 1
+        clusters = collisions.colliding_clusters(*self.collision_arrays(), self.dT, counters=self.counters)
+        collided = set([i for c in clusters for i in c])
+        removed = [[self.current_system[i] for i in c] for c in clusters]
+        new = [n for i, n in enumerate(self.current_system) if i not in collided]
         return removed, new
 
     # 10.
-    # This function deals with transfer of momentum and other physical attributes. I've since discovered that 
-    # pygame has it's own collsion handling methods but the 2-3 other projects I have seen since 
-    # still don't seem to address momentum transfer. The following is fine until masses at different locations 
-    # occasionally collide simulatneously. 
+    # This function deals with transfer of momentum and other physical attributes. Every cluster
+    # of colliding masses becomes one new mass: total mass and momentum are conserved, it sits at 
+    # the cluster's center of mass, has the mass weighted average density and the colour of the 
+    # heaviest member. If the object being followed is in the cluster, the new mass takes its ID. 
+    # self.merges logs (IDs merged, new ID) so anything tracking IDs can follow them.
     def combine_removed_masses(self):
         removed, new = self.remove_collided()
-        if len(removed) > 0:
-            new = self.restrict_system_size(new)
-            total_mass = sum([n.m for n in new])
-            masses_collected = [n.m for n in removed]
-            ind = masses_collected.index(max(masses_collected))
-            self.substitute_colour = removed[ind].colour
-            m_final = 0
-            density = 0
-            px,py = 0,0
-            sx,sy = 0,0
-            rem_pos_x, rem_pos_y = [], []
-            append=False
-            for n in removed: 
-                rem_pos_x, rem_pos_y = [j.s[0] for j in removed if j.locale == n.locale], [j.s[1] for j in removed if j.locale == n.locale]
-                mass_ratio = 0
-                for i in n.others:
-                    if i in removed and i.locale == n.locale: 
-                        m_final += n.m
-                        density += n.avg_density*n.m 
-                        mass_ratio += i.m/(n.m+i.m) 
-                        px += n.m*n.v[0]
-                        py += n.m*n.v[1] 
-                        sx += n.s[0]*(1-mass_ratio)   
-                        sy += n.s[1]*(1-mass_ratio)   
-            if sx >= min(rem_pos_x) and sx<max(rem_pos_x) and sy >=min(rem_pos_y) and sy<max(rem_pos_y):
-                append=True
-            elif sx > min(rem_pos_x) and sx<=max(rem_pos_x) and sy >min(rem_pos_y) and sy<=max(rem_pos_y):
-                append=True  
-            if append: 
-                p_final= [px,py]
-                v_f = [n/m_final for n in p_final] 
-                for n in v_f: 
-                    if n >10**2: n ==10**2
-                v_final = [n for n in v_f]
-                avg_density = density/m_final
-                s_final = [sx,sy]
-                M = Mass(m=m_final, s=s_final, v=v_final, colour = self.substitute_colour, 
-                            avg_density = avg_density)
-                new.append(M)
-                new[-1].gR=[0,0]
-                for n in removed: 
-                    if n.ID == self.main.center_object_ID:
-                        new[-1].ID = self.main.center_object_ID
-                self.rem_ids = [n.ID for n in removed]
-                self.new_ids = [n.ID for n in new]
-                new_total_mass = sum([n.m for n in new])
-                # Now if the above criterior are not met, the updated system will simply not 
-                # contain the new mass. This causes masses to 'vanish'. 
-                if new_total_mass >= total_mass:
-                    self.current_system = new
-                # The above if block seems to help get around that a bit 
+        if len(removed) == 0: return
+        self.counters["merges"] += len(removed)
+        untouched = list(new)
+        for cluster in removed:
+            m_final = sum([n.m for n in cluster])
+            p_final = [sum([n.m*n.v[j] for n in cluster]) for j in range(2)]
+            s_final = [sum([n.m*n.s[j] for n in cluster])/m_final for j in range(2)]
+            avg_density = sum([n.avg_density*n.m for n in cluster])/m_final
+            heaviest = max(cluster, key=lambda n: n.m)
+            M = Mass(m=m_final, s=s_final, v=[n/m_final for n in p_final], colour=heaviest.colour, 
+                     avg_density=avg_density)
+            M.gR=[0,0]
+            ids = [n.ID for n in cluster]
+            if self.main.center_object_ID in ids:
+                M.ID = self.main.center_object_ID
+            self.merges.append((ids, M.ID))
+            new.append(M)
+        if self.monitor is not None:
+            self.monitor.replaced_masses([n for cluster in removed for n in cluster], new[len(untouched):], untouched)
+        self.rem_ids = [n.ID for cluster in removed for n in cluster]
+        self.new_ids = [n.ID for n in new]
+        self.current_system = new
     
 
     # _________________________________ Additional methods for efficiency_________________
+    # Positions, colours and dot sizes of every object, as arrays for the renderer
+    def render_arrays(self):
+        system = self.current_system
+        s = np.array([n.s for n in system], dtype=float).reshape(-1,2)
+        colours = np.array([n.colour for n in system], dtype=np.uint8).reshape(-1,3)
+        radii = np.array([n.dot_diameter for n in system], dtype=float)
+        return s, colours, radii
+
+    # IDs, positions, velocities, masses, colours and dot sizes, as published by a physics
+    # worker or written by a trajectory recorder
+    def snapshot_arrays(self):
+        s, colours, radii = self.render_arrays()
+        ids = np.array([n.ID for n in self.current_system], dtype=np.int64)
+        v = np.array([n.v for n in self.current_system], dtype=float).reshape(-1,2)
+        m = np.array([n.m for n in self.current_system], dtype=float)
+        return ids, s, v, m, colours, radii
+
+    # Position and velocity of the object with this ID, None once it has gone
+    def body_state(self, ID):
+        for n in self.current_system:
+            if n.ID == ID: return n.s, n.v
+        return None
+
+    # Releasing anything the engine holds outside this process, and ending the journal
+    def close(self):
+        if self.journal is not None: self.journal.close(self.main.frames, self.frame_dT)
+
+    # Potential energy of the system from the distances of the latest force pass (R_mag),
+    # for diagnostics samples taken straight after g_vectors
+    def pass_potential(self):
+        U = 0.0
+        for n in self.current_system:
+            for k in range(len(n.r_mag)):
+                U -= n.m*n.others[k].m/max(n.r_mag[k], n.real_diameter + n.others[k].real_diameter)
+        return 0.5*self.main.G*U
+
+    # Adding a new mass to the system, merging it straight away if it lands on another
+    def inject(self, M):
+        if self.monitor is not None: self.monitor.replaced_masses([], [M], self.current_system)
+        if self.journal is not None: self.journal.injected(self.main.frames, self.frame_dT, M)
+        self.current_system.append(M)
+        self.combine_removed_masses()
+
+
     # 11 *
     def object_locale_data(self):
         uniques = []
@@ -221,22 +250,24 @@ class Gravitation:
             if n.locale not in uniques: uniques.append(n.locale)
     # 12 **
     def restrict_system_size(self, system): 
+        before = list(system) if self.monitor is not None else None
         for n in system:
             if n.locale is not None:
                 item = n.locale
                 for i in item:
                     if abs(i) > 1.1*math.log10(self.main.SCREEN_SCALE*self.main.AU):
                         system.remove(n)
+        if before is not None and len(system) < len(before):
+            kept = set([id(n) for n in system])
+            self.monitor.replaced_masses([n for n in before if id(n) not in kept], [], system)
         return system
     
     """
     11 * 
-        It turns out the methods above do not perfeorm well when multiple collisions occur
-        simulatneously at different points in space. Although the issue has not been resolved, it has 
-        been mitigated. 
-        The above method labels all removed objects with a locale attribute - arounded base ten 
-        logarithm of the position vector which will be the same for distinct clusters of coliding 
-        objects. It could be crucial to a better method for handling collisons. 
+        Labels every object with a locale attribute - a rounded base ten logarithm of the 
+        position vector. It used to decide which removed objects belonged to the same collision,
+        which broke down when collisions happened simultaneously at different points in space;
+        clusters now come from collisions.py, and the locale is only used by method 12.
 
     12 ** Eliminating objects which are way off screen
     __________________________________________________________________________________________________
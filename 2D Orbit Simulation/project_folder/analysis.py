@@ -0,0 +1,308 @@
+import os
+import csv
+import math
+import json
+import argparse
+from collections import deque
+import numpy as np
+from simulation import Simulation
+from collisions import candidate_pairs
+from recorder import TrajectoryReader
+
+
+"""
+Orbit analysis of a run as it goes, live or recorded:
+
+    python -m analysis run_dir --bodies bodies.npz --events events.csv     a recorded run
+    python -m headless --years 100 --analysis bodies.npz --events events.csv     a live run
+
+(from inside project_folder). Every sampled frame, the osculating orbital elements of every
+object about the primary (center_object_ID if given and still there, otherwise the
+heaviest object) are worked out at once from the positions and velocities relative to it:
+semi-major axis, eccentricity, periapsis, apoapsis and period, all in SI units. Nothing is
+kept per frame: each object has one row of running totals, and events are streamed as they
+are found.
+
+    ejection        an object bound to the primary (negative orbital energy) becomes unbound
+    capture         an unbound object becomes bound
+    close_approach  two massive objects within approach metres of each other, reported once
+                    they part, at their closest
+    merge / lost    an object disappears, merged (known from Gravitation.merges, or the merge
+                    log of a recording; recordings made before merges were logged assume a
+                    merge when a new object appears in the same frame) or lost (removed by
+                    restrict_system_size, absorbed tracers)
+
+Tables are written column by column to .npz (one array per column), .csv, or .parquet when
+pyarrow is installed. """
+
+EVENTS = ("ejection", "capture", "close_approach", "merge", "lost")
+FATES = ("present", "merged", "lost")
+STATS = np.dtype([("ID", "<i8"), ("m", "<f8"), ("first_time", "<f8"), ("last_time", "<f8"), ("samples", "<i8"),
+                  ("bound_samples", "<i8"), ("a_min", "<f8"), ("a_max", "<f8"), ("a_sum", "<f8"),
+                  ("e_min", "<f8"), ("e_max", "<f8"), ("e_sum", "<f8"), ("periapsis_min", "<f8"),
+                  ("apoapsis_max", "<f8"), ("period_sum", "<f8"), ("bound", "?"), ("present", "?"),
+                  ("fate", "u1"), ("fate_time", "<f8"), ("ejections", "<i4"), ("captures", "<i4"),
+                  ("close_approaches", "<i4")])
+
+
+# Osculating elements of bodies at r (N x 2) with velocities w (N x 2), both relative to the
+# primary, and mu = G*(M_primary + m). Unbound orbits have a negative semi-major axis and
+# an infinite apoapsis and period.
+def orbital_elements(r, w, mu):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = np.hypot(r[:,0], r[:,1])
+        v2 = (w*w).sum(axis=1)
+        energy = 0.5*v2 - mu/dist
+        h = r[:,0]*w[:,1] - r[:,1]*w[:,0]
+        rw = (r*w).sum(axis=1)
+        e_vec = ((v2 - mu/dist)[:,None]*r - rw[:,None]*w)/mu[:,None]
+        e = np.hypot(e_vec[:,0], e_vec[:,1])
+        a = -mu/(2*energy)
+        bound = energy < 0
+        periapsis = h*h/(mu*(1 + e))
+        apoapsis = np.where(bound, a*(1 + e), np.inf)
+        period = np.where(bound, 2*math.pi*np.sqrt(np.abs(a)**3/mu), np.inf)
+    return {"a": a, "e": e, "periapsis": periapsis, "apoapsis": apoapsis, "period": period,
+            "energy": energy, "bound": bound}
+
+# Columns (name -> array) written to .npz, .csv or .parquet
+def write_columns(path, columns):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npz":
+        np.savez(path, **columns)
+    elif extension == ".parquet":
+        import pyarrow, pyarrow.parquet          # Optional, only needed for this format
+        pyarrow.parquet.write_table(pyarrow.table({k: np.asarray(v) for k, v in columns.items()}), path)
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(columns))
+            writer.writerows(zip(*[np.asarray(v).tolist() for v in columns.values()]))
+
+
+"""
+OrbitAnalysis takes one frame at a time, through update (arrays) or record (a Gravitation
+instance, the way Simulation.simulate hands frames to a recorder), every every-th frame.
+Objects are found in the running totals by a sorted ID index, so a frame costs a few
+vectorised passes and one sort, whatever the number of objects. """
+class OrbitAnalysis:
+
+    def __init__(self, G, primary_ID=None, approach=0.05*Simulation.AU, every=1, history=10**5, events=None):
+        assert every >= 1 and approach >= 0
+        self.G, self.primary_ID, self.approach, self.every = G, primary_ID, approach, every
+        self.stats = np.zeros(0, dtype=STATS)
+        self.count = 0                                 # Rows of stats in use
+        self.index_ids, self.index_rows = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.approaches = {}                           # (ID, ID) -> [closest distance, time] while close
+        self.events = deque(maxlen=history)
+        self.output, self.file, self.writer = events, None, None
+        self.calls, self.frames, self.merges_seen = 0, 0, 0
+        self.primary = None
+
+    # ________________________ Feeding frames
+    def record(self, time_elapsed, Model_System):
+        self.calls += 1
+        if (self.calls - 1) % self.every != 0: return
+        ids, s, v, m, _, _ = Model_System.snapshot_arrays()
+        merges = getattr(Model_System, "merges", None)
+        new_merges = None
+        if merges is not None:
+            if len(merges) < self.merges_seen: self.merges_seen = 0
+            new_merges, self.merges_seen = merges[self.merges_seen:], len(merges)
+        self.update(time_elapsed, ids, s, v, m, merges=new_merges)
+
+    def update(self, time_elapsed, ids, s, v, m, merges=None):
+        ids = np.asarray(ids, dtype=np.int64)
+        rows, appeared = self.rows_for(ids, time_elapsed)
+        stats = self.stats
+        vanished = np.flatnonzero(stats["present"][:self.count])
+        vanished = vanished[~np.isin(vanished, rows)]
+        stats["present"][vanished] = False
+        self.disappeared(time_elapsed, vanished, merges, appeared)
+        stats["present"][rows], stats["m"][rows], stats["last_time"][rows] = True, m, time_elapsed
+        stats["samples"][rows] += 1
+        self.frames += 1
+        if len(ids) == 0: return
+        primary = self.primary_index(ids, m)
+        self.primary = int(ids[primary])
+        others = np.arange(len(ids)) != primary
+        if others.any(): self.elements(time_elapsed, rows[others], s[others] - s[primary], v[others] - v[primary],
+                                       self.G*(m[primary] + m[others]))
+        if self.approach > 0: self.close_approaches(time_elapsed, ids, s, m)
+
+    # Rows of the running totals for these IDs, adding rows for IDs not seen before
+    def rows_for(self, ids, time_elapsed):
+        where = np.searchsorted(self.index_ids, ids)
+        found = np.zeros(len(ids), dtype=bool)
+        inside = where < len(self.index_ids)
+        found[inside] = self.index_ids[where[inside]] == ids[inside]
+        appeared = np.unique(ids[~found])
+        if len(appeared) > 0:
+            new = np.arange(self.count, self.count + len(appeared))
+            self.grow(self.count + len(appeared))
+            self.stats[new] = np.zeros(len(new), dtype=STATS)
+            self.stats["ID"][new], self.stats["first_time"][new] = appeared, time_elapsed
+            for name in ("a_min", "e_min", "periapsis_min"): self.stats[name][new] = np.inf
+            for name in ("a_max", "e_max", "apoapsis_max"): self.stats[name][new] = -np.inf
+            self.count += len(appeared)
+            index_ids = np.concatenate([self.index_ids, appeared])
+            order = np.argsort(index_ids, kind="stable")
+            self.index_ids, self.index_rows = index_ids[order], np.concatenate([self.index_rows, new])[order]
+            where = np.searchsorted(self.index_ids, ids)
+        appeared = appeared if self.frames > 0 else appeared[:0]
+        return self.index_rows[where], appeared
+
+    def grow(self, size):
+        if size <= len(self.stats): return
+        stats = np.zeros(max(size, 2*len(self.stats), 16), dtype=STATS)
+        stats[:self.count] = self.stats[:self.count]
+        self.stats = stats
+
+    def primary_index(self, ids, m):
+        if self.primary_ID is not None:
+            found = np.flatnonzero(ids == self.primary_ID)
+            if len(found) > 0: return int(found[0])
+        return int(np.argmax(m))
+
+    # ________________________ Elements and events
+    def elements(self, time_elapsed, rows, r, w, mu):
+        el = orbital_elements(r, w, mu)
+        stats, bound = self.stats, el["bound"]
+        seen = stats["samples"][rows] > 1
+        was_bound = stats["bound"][rows]
+        for kind, changed in (("ejection", seen & was_bound & ~bound), ("capture", seen & ~was_bound & bound)):
+            for row in rows[changed].tolist():
+                stats[kind + "s"][row] += 1
+                self.event(kind, time_elapsed, int(stats["ID"][row]))
+        stats["bound"][rows] = bound
+        stats["e_min"][rows] = np.minimum(stats["e_min"][rows], el["e"])
+        stats["e_max"][rows] = np.maximum(stats["e_max"][rows], el["e"])
+        stats["e_sum"][rows] += el["e"]
+        stats["periapsis_min"][rows] = np.minimum(stats["periapsis_min"][rows], el["periapsis"])
+        b = rows[bound]
+        stats["bound_samples"][b] += 1
+        stats["a_min"][b] = np.minimum(stats["a_min"][b], el["a"][bound])
+        stats["a_max"][b] = np.maximum(stats["a_max"][b], el["a"][bound])
+        stats["a_sum"][b] += el["a"][bound]
+        stats["apoapsis_max"][b] = np.maximum(stats["apoapsis_max"][b], el["apoapsis"][bound])
+        stats["period_sum"][b] += el["period"][bound]
+
+    # Objects gone since the last frame: merged if Gravitation.merges says so or, without
+    # merges, if another object appeared in the same frame; lost otherwise. Tracers never merge.
+    def disappeared(self, time_elapsed, vanished, merges, appeared):
+        if len(vanished) == 0: return
+        appeared, into = appeared[appeared >= 0], {}
+        if merges is not None:
+            for ids, new in merges:
+                for ID in ids: into[ID] = new
+        for row in vanished.tolist():
+            ID = int(self.stats["ID"][row])
+            merged = ID in into if merges is not None else ID >= 0 and len(appeared) > 0
+            other = into.get(ID, int(appeared[0]) if merges is None and merged else -1)
+            self.stats["fate"][row] = FATES.index("merged" if merged else "lost")
+            self.stats["fate_time"][row] = time_elapsed
+            self.event("merge" if merged else "lost", time_elapsed, ID, other)
+
+    # Pairs of massive objects closer than approach, found by a sweep along x
+    def close_approaches(self, time_elapsed, ids, s, m):
+        massive = np.flatnonzero(m > 0)
+        i, j = candidate_pairs(s[massive], np.full(len(massive), 0.5*self.approach))
+        i, j = massive[i], massive[j]
+        r = s[j] - s[i]
+        dist = np.hypot(r[:,0], r[:,1])
+        close = dist <= self.approach
+        current = set()
+        for a, b, d in zip(ids[i[close]].tolist(), ids[j[close]].tolist(), dist[close].tolist()):
+            key = (min(a, b), max(a, b))
+            current.add(key)
+            closest = self.approaches.setdefault(key, [d, time_elapsed])
+            if d < closest[0]: closest[0], closest[1] = d, time_elapsed
+        for key in [key for key in self.approaches if key not in current]:
+            self.approach_ended(key)
+
+    def approach_ended(self, key):
+        distance, time_elapsed = self.approaches.pop(key)
+        for ID in key:
+            found = np.searchsorted(self.index_ids, ID)
+            self.stats["close_approaches"][self.index_rows[found]] += 1
+        self.event("close_approach", time_elapsed, key[0], key[1], distance)
+
+    def event(self, kind, time_elapsed, ID, other=-1, distance=float("nan")):
+        row = {"event": kind, "time": time_elapsed, "ID": ID, "other": other, "distance": distance,
+               "primary": self.primary if self.primary is not None else -1}
+        self.events.append(row)
+        if self.output is None: return
+        if self.writer is None:
+            self.file = open(self.output, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+            self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    # ________________________ Results
+    # Approaches still going on are reported at their closest so far
+    def close(self):
+        for key in list(self.approaches): self.approach_ended(key)
+        if self.file is not None: self.file.close()
+        self.file, self.writer = None, None
+
+    def bodies(self):
+        stats = self.stats[:self.count]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            b = stats["bound_samples"]
+            columns = {"ID": stats["ID"], "m": stats["m"], "first_time": stats["first_time"],
+                       "last_time": stats["last_time"], "samples": stats["samples"],
+                       "bound_fraction": b/np.maximum(stats["samples"], 1),
+                       "a_mean": np.where(b > 0, stats["a_sum"]/b, np.nan),
+                       "a_min": np.where(b > 0, stats["a_min"], np.nan), "a_max": np.where(b > 0, stats["a_max"], np.nan),
+                       "e_mean": stats["e_sum"]/np.maximum(stats["samples"], 1),
+                       "e_min": stats["e_min"], "e_max": stats["e_max"], "periapsis_min": stats["periapsis_min"],
+                       "apoapsis_max": np.where(b > 0, stats["apoapsis_max"], np.nan),
+                       "period_mean": np.where(b > 0, stats["period_sum"]/b, np.nan),
+                       "bound": stats["bound"] & (stats["ID"] != self.primary),
+                       "fate": np.array(FATES)[stats["fate"]], "fate_time": stats["fate_time"],
+                       "ejections": stats["ejections"], "captures": stats["captures"],
+                       "close_approaches": stats["close_approaches"]}
+        return columns
+
+    def event_columns(self):
+        return {key: np.array([row[key] for row in self.events]) for key in ("event", "time", "ID", "other",
+                                                                              "distance", "primary")}
+
+    def summary(self):
+        columns = self.bodies()
+        present = columns["fate"] == "present"
+        counts = {kind: sum([row["event"] == kind for row in self.events]) for kind in EVENTS}
+        return {"frames": self.frames, "primary": self.primary, "bodies": int(self.count),
+                "bound": [int(ID) for ID in columns["ID"][present & columns["bound"]]],
+                "unbound": [int(ID) for ID in columns["ID"][present & ~columns["bound"] & (columns["ID"] != self.primary)]],
+                "events": counts}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Orbital elements and events of a recorded run.")
+    parser.add_argument("recording", help="directory of a recorded run (see recorder.py)")
+    parser.add_argument("--primary", type=int, default=None, help="ID of the object orbits are taken about")
+    parser.add_argument("--approach", type=float, default=0.05, help="close approach distance in AU")
+    parser.add_argument("--every", type=int, default=1, help="analyse every N recorded frames")
+    parser.add_argument("--bodies", default=None, help=".npz, .csv or .parquet file for the per object table")
+    parser.add_argument("--events", default=None, help="CSV file the events are streamed to")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    analysis = OrbitAnalysis(Simulation.G, primary_ID=args.primary, approach=args.approach*Simulation.AU,
+                             every=args.every, events=args.events)
+    reader = TrajectoryReader(args.recording)
+    for k in range(0, len(reader), args.every):
+        time_elapsed, rows = reader.frame(k)
+        merges = reader.merges(k, first=k - args.every)
+        analysis.update(time_elapsed, rows["ID"], rows["s"], rows["v"], rows["m"], merges=merges)
+    analysis.close()
+    if args.bodies is not None: write_columns(args.bodies, analysis.bodies())
+    summary = analysis.summary()
+    print(json.dumps(summary, indent=2))
+    return summary
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import numpy as np
+
+
+DEPTH = 20                   # Deepest level of the tree, cells there are 2**-20 of the root's width
+
+
+# Spreading the bits of each integer apart so a zero sits between each of them.
+# Interleaving x and y cell indices this way gives the Morton (Z-order) code.
+def part1by1(n):
+    n = n.astype(np.uint64) & np.uint64(0x00000000ffffffff)
+    n = (n | (n << np.uint64(16))) & np.uint64(0x0000ffff0000ffff)
+    n = (n | (n << np.uint64(8)))  & np.uint64(0x00ff00ff00ff00ff)
+    n = (n | (n << np.uint64(4)))  & np.uint64(0x0f0f0f0f0f0f0f0f)
+    n = (n | (n << np.uint64(2)))  & np.uint64(0x3333333333333333)
+    n = (n | (n << np.uint64(1)))  & np.uint64(0x5555555555555555)
+    return n
+
+# Concatenation of arange(start, end) for every (start, end) pair, without a Python loop
+def ranges(starts, ends):
+    counts = ends - starts
+    total = counts.sum()
+    if total == 0: return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return np.arange(total) + offsets
+
+# best[i] = min(best[i], values of i) for sorted group indices, quicker than np.minimum.at
+def group_min(best, idx, values):
+    if len(idx) == 0: return
+    first = np.flatnonzero(np.concatenate(([True], idx[1:] != idx[:-1])))
+    best[idx[first]] = np.minimum(best[idx[first]], np.minimum.reduceat(values, first))
+
+
+"""
+QuadTree is built from the positions and masses of every object at the start of a step. Bodies
+are sorted along a Z-order curve so that every cell of the tree owns a contiguous slice of the
+sorted bodies, which lets the tree be built one level at a time with array operations rather
+than by inserting bodies one by one. Each cell stores its total mass and center of mass. When
+calculating accelerations, a cell whose width is less than theta times its distance from the
+target is treated as a single point mass; otherwise it is opened and its children examined.
+theta = 0 opens every cell and reproduces exact all-pairs summation. """
+class QuadTree:
+
+    def __init__(self, s, m, diameter, depth=DEPTH):
+        self.depth = depth
+        self.N = len(s)
+        self.interactions = 0            # Cell and body interactions summed by accelerations
+        self.build(np.asarray(s, dtype=float).reshape(-1,2), np.asarray(m, dtype=float),
+                   np.asarray(diameter, dtype=float))
+
+    # ________________________ Building the tree
+    def build(self, s, m, diameter):
+        self.s, self.m, self.diameter = s, m, diameter
+        if self.N == 0:
+            self.first_child = np.zeros(0, dtype=np.int64)
+            return
+        lo = s.min(axis=0)
+        width = (s.max(axis=0) - lo).max()*(1 + 10**-9)
+        if width == 0: width = 1.0
+        cells = 2**self.depth
+        ij = np.minimum(((s - lo)/width*cells).astype(np.int64), cells - 1)
+        code = part1by1(ij[:,0]) | (part1by1(ij[:,1]) << np.uint64(1))
+        self.order = np.argsort(code, kind='stable')
+        code, ij = code[self.order], ij[self.order]
+        ms, ss = m[self.order], s[self.order]
+
+        # 1. Cells level by level, each as a [start, end) slice of the sorted bodies.
+        #    Only cells holding more than one body are split further.
+        starts, ends, levels, parents = [np.array([0])], [np.array([self.N])], [0], [np.zeros(0, dtype=np.int64)]
+        for level in range(1, self.depth + 1):
+            split = (ends[-1] - starts[-1]) > 1
+            if not split.any(): break
+            ps, pe = starts[-1][split], ends[-1][split]
+            idx = ranges(ps, pe)
+            prefix = code[idx] >> np.uint64(2*(self.depth - level))
+            new = np.ones(len(idx), dtype=bool)
+            new[1:] = (prefix[1:] != prefix[:-1]) | (idx[1:] != idx[:-1] + 1)
+            first = np.flatnonzero(new)
+            cs = idx[first]
+            ce = cs + np.diff(np.append(first, len(idx)))
+            starts.append(cs)
+            ends.append(ce)
+            levels.append(level)
+            parents.append(np.flatnonzero(split)[np.searchsorted(ps, cs, side='right') - 1])
+
+        # 2. Flattening the levels into one array per attribute, and linking parents to children
+        offsets = np.cumsum([0] + [len(n) for n in starts])
+        self.start, self.end = np.concatenate(starts), np.concatenate(ends)
+        self.level = np.concatenate([np.full(len(n), l) for n, l in zip(starts, levels)])
+        self.first_child = np.zeros(len(self.start), dtype=np.int64)
+        self.n_child = np.zeros(len(self.start), dtype=np.int64)
+        for k in range(1, len(starts)):
+            parent = parents[k] + offsets[k-1]
+            self.n_child += np.bincount(parent, minlength=len(self.start))
+            first = np.searchsorted(parents[k], np.arange(len(starts[k-1])), side='left')
+            has = np.bincount(parents[k], minlength=len(starts[k-1])) > 0
+            self.first_child[offsets[k-1]:offsets[k]][has] = first[has] + offsets[k]
+
+        # 3. Mass and center of mass of every cell from cumulative sums over the sorted bodies
+        cm = np.concatenate(([0.0], np.cumsum(ms)))
+        cmx = np.concatenate(([0.0], np.cumsum(ms*ss[:,0])))
+        cmy = np.concatenate(([0.0], np.cumsum(ms*ss[:,1])))
+        self.mass = cm[self.end] - cm[self.start]
+        self.com = np.zeros((len(self.start), 2))
+        np.divide(cmx[self.end] - cmx[self.start], self.mass, out=self.com[:,0], where=self.mass > 0)
+        np.divide(cmy[self.end] - cmy[self.start], self.mass, out=self.com[:,1], where=self.mass > 0)
+        single = (self.end - self.start) == 1
+        self.com[single] = ss[self.start[single]]
+
+        # 4. Cell geometry
+        self.size = width/2.0**self.level
+        cell = ij[self.start] >> (self.depth - self.level)[:,None]
+        self.center = lo + (cell + 0.5)*self.size[:,None]
+        empty = self.mass <= 0
+        self.com[empty] = self.center[empty]
+
+    # ________________________ Walking the tree
+    # Accelerations on the target bodies (indices into the original arrays). Leaf cells are
+    # summed exactly with the same surface-distance cutoff g_vectors uses.
+    def accelerations(self, G, theta=0.5, targets=None, chunk_size=4096):
+        if targets is None: targets = np.arange(self.N)
+        a = np.zeros((len(targets), 2))
+        if self.N == 0: return a
+        for start in range(0, len(targets), chunk_size):
+            tgt = targets[start:start+chunk_size]
+            ax, ay = np.zeros(len(tgt)), np.zeros(len(tgt))
+            pair_t = np.arange(len(tgt))
+            pair_n = np.zeros(len(tgt), dtype=np.int64)
+            while len(pair_t) > 0:
+                pos = self.s[tgt[pair_t]]
+                leaf = self.n_child[pair_n] == 0
+                r = self.com[pair_n] - pos
+                dist = np.hypot(r[:,0], r[:,1])
+                size = self.size[pair_n]
+                inside = (np.abs(pos - self.center[pair_n]) <= 0.5*size[:,None]).all(axis=1)
+                far = ~leaf & ~inside & (size < theta*dist)
+
+                # Distant cells act as a single mass at their center of mass
+                w = G*self.mass[pair_n[far]]/dist[far]**3
+                ax += np.bincount(pair_t[far], weights=w*r[far,0], minlength=len(tgt))
+                ay += np.bincount(pair_t[far], weights=w*r[far,1], minlength=len(tgt))
+
+                # Leaves are summed body by body
+                lt, ln = pair_t[leaf], pair_n[leaf]
+                j = self.order[ranges(self.start[ln], self.end[ln])]
+                self.interactions += int(far.sum()) + len(j)
+                jt = np.repeat(lt, self.end[ln] - self.start[ln])
+                rj = self.s[j] - self.s[tgt[jt]]
+                dj = np.hypot(rj[:,0], rj[:,1])
+                outside = dj > self.diameter[tgt[jt]] + self.diameter[j]
+                wj = np.zeros(len(j))
+                np.divide(G*self.m[j], dj**3, out=wj, where=outside)
+                ax += np.bincount(jt, weights=wj*rj[:,0], minlength=len(tgt))
+                ay += np.bincount(jt, weights=wj*rj[:,1], minlength=len(tgt))
+
+                # Remaining cells are too close, so they are opened
+                op = ~leaf & ~far
+                ot, on = pair_t[op], pair_n[op]
+                pair_t = np.repeat(ot, self.n_child[on])
+                pair_n = ranges(self.first_child[on], self.first_child[on] + self.n_child[on])
+            a[start:start+len(tgt), 0], a[start:start+len(tgt), 1] = ax, ay
+        return a
+
+    # Distance from each target body to its nearest neighbour. Any cell holding a body other
+    # than the target bounds that distance by its farthest corner, so cells whose nearest
+    # edge is beyond the best bound found so far are never opened.
+    def nearest(self, targets=None, chunk_size=4096):
+        if targets is None: targets = np.arange(self.N)
+        out = np.full(len(targets), np.inf)
+        if self.N < 2: return out
+        for start in range(0, len(targets), chunk_size):
+            tgt = targets[start:start+chunk_size]
+            best = np.full(len(tgt), np.inf)
+            pair_t = np.arange(len(tgt))
+            pair_n = np.zeros(len(tgt), dtype=np.int64)
+            while len(pair_t) > 0:
+                pos = self.s[tgt[pair_t]]
+                count = self.end[pair_n] - self.start[pair_n]
+                leaf = self.n_child[pair_n] == 0
+                offset = np.abs(pos - self.center[pair_n])
+                half = 0.5*self.size[pair_n][:,None]
+                edge = np.maximum(offset - half, 0)
+                corner = offset + half
+                near = np.hypot(edge[:,0], edge[:,1])
+                bound = np.hypot(corner[:,0], corner[:,1])
+                single = count == 1
+                j = self.order[self.start[pair_n[single]]]
+                rj = self.s[j] - pos[single]
+                bound[single] = np.where(j == tgt[pair_t[single]], np.inf, np.hypot(rj[:,0], rj[:,1]))
+                group_min(best, pair_t, bound)
+                keep = ~single & (near <= best[pair_t])
+
+                # Leaves at the deepest level can hold several bodies, checked one by one
+                lt, ln = pair_t[keep & leaf], pair_n[keep & leaf]
+                j = self.order[ranges(self.start[ln], self.end[ln])]
+                jt = np.repeat(lt, self.end[ln] - self.start[ln])
+                rj = self.s[j] - self.s[tgt[jt]]
+                dj = np.where(j == tgt[jt], np.inf, np.hypot(rj[:,0], rj[:,1]))
+                group_min(best, jt, dj)
+
+                op = keep & ~leaf
+                ot, on = pair_t[op], pair_n[op]
+                pair_t = np.repeat(ot, self.n_child[on])
+                pair_n = ranges(self.first_child[on], self.first_child[on] + self.n_child[on])
+            out[start:start+len(tgt)] = best
+        return out
@@ -0,0 +1,154 @@
+import argparse
+import json
+import sys
+import tracemalloc
+from simulation import Simulation
+from profiler import Profiler
+from scenarios import load_scenario
+from diagnostics import Conservation
+
+
+"""
+Benchmarks of the Gravitation step sequence (the one Main.update_position runs), without a
+display:
+
+    python -m benchmark                                  quick suite, prints a table
+    python -m benchmark --suite full --output run.json   N = 10 to 10**5
+    python -m benchmark --save-baseline baseline.json    store results to compare against
+    python -m benchmark --baseline baseline.json         compare, exit code 1 on a regression
+
+(from inside project_folder). Every case runs a fixed number of frames, so a fixed
+simulated time, and reports frames per second (from the median frame time), the time spent in each Gravitation method,
+the peak memory allocated during one frame, the objects left out of the n it started with,
+and the relative drift of the energy, momentum and angular momentum over the run, as
+diagnostics.Conservation gives it: the jumps of merges and removals are taken out, so the
+drift is the integrator's alone. Generated systems use a fixed seed so runs are repeatable. """
+
+def case(scenario, n, engine="vector", solver="direct", integrator="euler", time_step=3000, steps=100):
+    return {"name": "%s-%d-%s-%s-%s" % (scenario, n, engine, solver, integrator), "scenario": scenario,
+            "n": n, "engine": engine, "solver": solver, "integrator": integrator,
+            "time_step": time_step, "steps": steps}
+
+SUITES = {
+    "quick": [case("solar_system", 9, engine="classic", steps=1000),
+              case("solar_system", 9, steps=5000),
+              case("solar_system", 9, integrator="yoshida4", time_step=30000, steps=1000),
+              case("disk", 100, integrator="leapfrog", steps=500),
+              case("cluster", 100, integrator="leapfrog", steps=500),
+              case("disk", 1000, steps=20),
+              case("disk", 1000, solver="barnes_hut", steps=20)],
+    "full": [case("solar_system", 9, engine="classic", steps=1000),
+             case("solar_system", 9, steps=10000),
+             case("solar_system", 9, integrator="leapfrog", time_step=30000, steps=1000),
+             case("solar_system", 9, integrator="yoshida4", time_step=30000, steps=1000),
+             case("solar_system", 9, integrator="rk4", time_step=30000, steps=1000),
+             case("disk", 10, engine="classic", steps=300),
+             case("disk", 100, engine="classic", steps=10)]
+           + [case(scenario, n, integrator="leapfrog", steps=steps)
+              for scenario in ("disk", "cluster")
+              for n, steps in ((10, 1000), (100, 300), (1000, 30), (10**4, 3))]
+           + [case(scenario, n, solver="barnes_hut", integrator="leapfrog", steps=steps)
+              for scenario in ("disk", "cluster")
+              for n, steps in ((1000, 30), (10**4, 5), (10**5, 2))]
+           + [case("cluster", 1000, integrator="block", time_step=30000, steps=10)],
+}
+
+
+def run_case(c, energy_limit=20000):
+    system = load_scenario(c["scenario"], n=c["n"], seed=0)
+    sim = Simulation(input=system)
+    sim.ENGINE, sim.SOLVER, sim.INTEGRATOR, sim.TIME_STEP = c["engine"], c["solver"], c["integrator"], c["time_step"]
+    Model_System = sim.build_model()
+    for _ in range(2):                   # Warming up, and dropping objects restrict_system_size
+        sim.step(Model_System)           # removes (the classic engine does so on frame two)
+        sim.clock_tick(Model_System)
+    # Sampled on the first and last timed frames only (the force pass then sums the potential)
+    sim.monitor = Model_System.monitor = Conservation(sim.G, every=max(1, c["steps"] - 1), energy_limit=energy_limit)
+    sim.profiler = Profiler(sim.PHASES)
+    for _ in range(c["steps"]):
+        if len(Model_System.current_system) == 0: break
+        sim.step(Model_System)
+        sim.clock_tick(Model_System)
+    conservation = sim.monitor.summary()
+    profile = sim.profiler.summary()
+    frame_times = sorted([row["frame_ms"]/1000 for row in sim.profiler.frames])
+    frames, wall_time = len(frame_times), sum(frame_times)
+
+    sim.profiler = sim.monitor = Model_System.monitor = None
+    tracemalloc.start()                  # Peak memory of one more frame, kept out of the timings
+    sim.step(Model_System)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    median = frame_times[frames//2] if frames > 0 else 0     # Less affected by other load
+    result = dict(c)
+    result.update({"frames": frames, "simulated_time": sim.time_elapsed, "wall_time": wall_time,
+                   "steps_per_second": 1/median if median > 0 else 0,
+                   "phase_times": {name: t/1000 for name, t in profile["phase_ms"].items()},
+                   "counters": profile["counters"], "peak_memory": peak,
+                   "bodies_final": len(Model_System.current_system),
+                   "merges": profile["counters"].get("merges", 0),
+                   "drift": {key: conservation[key + "_drift"] for key in ("energy", "momentum", "angular_momentum")}})
+    return result
+
+# Cases which got slower or less accurate than the baseline by more than the tolerance
+def compare(results, baseline, tolerance=0.2):
+    old = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        if r["name"] not in old: continue
+        b = old[r["name"]]
+        r["speedup"] = r["steps_per_second"]/b["steps_per_second"] if b["steps_per_second"] > 0 else None
+        if r["speedup"] is not None and r["speedup"] < 1 - tolerance:
+            regressions.append("%s: %.2fx the baseline speed" % (r["name"], r["speedup"]))
+        for key in ("energy", "momentum", "angular_momentum"):
+            new_drift, old_drift = r["drift"][key], b["drift"][key]
+            if new_drift is None or old_drift is None: continue
+            if new_drift > (1 + tolerance)*old_drift + 1e-14:
+                regressions.append("%s: %s drift %.3g, baseline %.3g" % (r["name"], key, new_drift, old_drift))
+    return regressions
+
+def print_table(results):
+    print("%-44s %10s %-26s %9s %13s %10s %8s" % ("case", "frames/s", "slowest method", "peak MB", "bodies end/n",
+                                                  "dE/E", "vs base"))
+    for r in results:
+        dE, speedup = r["drift"]["energy"], r.get("speedup")
+        slowest = max(r["phase_times"], key=lambda name: r["phase_times"][name])
+        share = r["phase_times"][slowest]*r["frames"]/r["wall_time"] if r["wall_time"] > 0 else 0
+        print("%-44s %10.1f %-26s %9.2f %13s %10s %8s" % (
+            r["name"], r["steps_per_second"], "%s %.0f%%" % (slowest, 100*share),
+            r["peak_memory"]/2**20, "%d/%d" % (r["bodies_final"], r["n"]), "-" if dE is None else "%.2e" % dE,
+            "-" if speedup is None else "%.2fx" % speedup))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Gravitation step sequence.")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    parser.add_argument("--case", action="append", default=None, help="only run cases whose name contains this")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--save-baseline", default=None, help="store the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction slower or less accurate than the baseline counted as a regression")
+    parser.add_argument("--energy-limit", type=int, default=20000,
+                        help="largest system whose energy is worked out (all pairs)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = [c for c in SUITES[args.suite] if args.case is None or any(k in c["name"] for k in args.case)]
+    results = [run_case(c, energy_limit=args.energy_limit) for c in cases]
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+    print_table(results)
+    output = {"suite": args.suite, "python": sys.version.split()[0], "results": results}
+    for path in (args.output, args.save_baseline):
+        if path is None: continue
+        with open(path, "w") as f:
+            json.dump(output, f, indent=2, default=float)
+    for line in regressions: print("REGRESSION " + line)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
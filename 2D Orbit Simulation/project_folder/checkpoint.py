@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from tracers import Tracers
+
+
+"""
+Checkpoints hold everything needed to carry on a run exactly where it stopped: the state of
+every object (ID, position, velocity, mass, density, colour), the Mass.id counter, the
+followed object, Gravitation's new_ids, rem_ids and merges, the objects the classic engine
+has no locale for yet, any tracers, the elapsed time and the simulation settings. They are written as a single .npz file, first to a temporary file
+which is then renamed over the old checkpoint, so a crash mid-write never leaves a
+half-written checkpoint behind. """
+
+VERSION = 1
+
+
+def save_checkpoint(path, sim, Model_System):
+    system = Model_System.current_system
+    meta = {"version": VERSION, "mass_id": Mass.id, "distance_unit": Mass.distance_unit,
+            "scale": Mass.scale, "center_object_ID": sim.center_object_ID,
+            "time_elapsed": sim.time_elapsed, "frames": sim.frames, "new_ids": [int(n) for n in Model_System.new_ids],
+            "rem_ids": [int(n) for n in Model_System.rem_ids],
+            "merges": [[[int(i) for i in ids], int(new)] for ids, new in Model_System.merges],
+            "unlocated": [int(n.ID) for n in system if n.locale is None] if sim.ENGINE == "classic" else [],
+            "settings": sim.settings()}
+    tracers = getattr(Model_System, "tracers", Tracers())
+    meta["tracer_next_id"] = int(tracers.next_id)
+    meta["tracers_absorbed"] = int(Model_System.counters.get("tracers_absorbed", 0))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+                 ids=np.array([n.ID for n in system], dtype=np.int64),
+                 s=np.array([n.s for n in system], dtype=float).reshape(-1,2),
+                 v=np.array([n.v for n in system], dtype=float).reshape(-1,2),
+                 m=np.array([n.m for n in system], dtype=float),
+                 avg_density=np.array([n.avg_density for n in system], dtype=float),
+                 colours=np.array([n.colour for n in system], dtype=np.int64).reshape(-1,3),
+                 tracer_ids=tracers.ids, tracer_s=tracers.s, tracer_v=tracers.v, tracer_colours=tracers.colours)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# Rebuilding the Simulation and its Gravitation engine from a checkpoint
+def load_checkpoint(path):
+    with np.load(path) as data:
+        meta = json.loads(data["meta"].tobytes().decode())
+        assert meta["version"] == VERSION
+        system = []
+        for ID, s, v, m, density, colour in zip(data["ids"], data["s"], data["v"], data["m"],
+                                                data["avg_density"], data["colours"]):
+            n = Mass(m=float(m), s=[float(s[0]), float(s[1])], v=[float(v[0]), float(v[1])],
+                     colour=tuple(int(c) for c in colour), avg_density=float(density))
+            n.ID = int(ID)
+            system.append(n)
+        tracers = Tracers()
+        tracers.add(data["tracer_s"], data["tracer_v"])
+        tracers.ids, tracers.colours = data["tracer_ids"].copy(), data["tracer_colours"].copy()
+        tracers.next_id = meta["tracer_next_id"]
+    Mass.id = meta["mass_id"]
+    sim = Simulation(input=system, center_object_ID=meta["center_object_ID"])
+    for k, value in meta["settings"].items(): setattr(sim, k, value)
+    sim.apply_units()
+    sim.time_elapsed, sim.frames = meta["time_elapsed"], meta.get("frames", 0)
+    Model_System = sim.build_model()
+    Model_System.new_ids, Model_System.rem_ids = meta["new_ids"], meta["rem_ids"]
+    Model_System.merges = [(ids, new) for ids, new in meta["merges"]]
+    Model_System.object_locale_data()            # Locales follow from the positions, except that
+    unlocated = set(meta.get("unlocated", []))   # masses added since the last pass have none yet
+    for n in Model_System.current_system:
+        if n.ID in unlocated: n.locale = None
+    if hasattr(Model_System, "tracers"):          # Replacing the belt build_model adds, even when none are left
+        Model_System.tracers = tracers
+        Model_System.counters["tracers_absorbed"] = meta.get("tracers_absorbed", 0)
+    return sim, Model_System
+
+
+"""
+Checkpointer saves a checkpoint every so many frames and/or every so many seconds of wall
+clock time, whichever comes first. Simulation.simulate calls update after every frame. """
+class Checkpointer:
+
+    def __init__(self, path, every_frames=None, every_seconds=None):
+        assert every_frames is not None or every_seconds is not None
+        self.path, self.every_frames, self.every_seconds = path, every_frames, every_seconds
+        self.frames, self.last_save, self.saved = 0, time.perf_counter(), 0
+
+    def update(self, sim, Model_System):
+        self.frames += 1
+        due = self.every_frames is not None and self.frames % self.every_frames == 0
+        due = due or (self.every_seconds is not None and time.perf_counter() - self.last_save >= self.every_seconds)
+        if due: self.save(sim, Model_System)
+
+    def save(self, sim, Model_System):
+        save_checkpoint(self.path, sim, Model_System)
+        self.last_save = time.perf_counter()
+        self.saved += 1
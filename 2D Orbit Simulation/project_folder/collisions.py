@@ -0,0 +1,72 @@
+import numpy as np
+from barnes_hut import ranges
+
+
+"""
+Collision detection in two phases. The broad phase sorts every object by the left edge of
+the interval it can reach along x within one step (half its diameter plus the distance its
+speed carries it) and sweeps along that order, so only pairs whose intervals overlap in x
+and y are examined. The narrow phase then applies the same test Gravitation has always used:
+
+    distance <= 0.5*(D1 + D2) + |(|vx1|+|vx2|, |vy1|+|vy2|)|*dT
+
+Colliding pairs are grouped into independent clusters with union-find, so simultaneous
+collisions at different points in space are merged separately. """
+
+
+# ________________________ Broad phase: sweep and prune
+def candidate_pairs(s, reach):
+    if len(s) < 2: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    lo, hi = s[:,0] - reach, s[:,0] + reach
+    order = np.argsort(lo, kind='stable')
+    lo, hi = lo[order], hi[order]
+    first = np.arange(1, len(s))
+    last = np.maximum(np.searchsorted(lo, hi[:-1], side='right'), first)
+    i = np.repeat(np.arange(len(s) - 1), last - first)
+    j = ranges(first, last)
+    i, j = order[i], order[j]
+    overlap = np.abs(s[i,1] - s[j,1]) <= reach[i] + reach[j]
+    return i[overlap], j[overlap]
+
+# ________________________ Narrow phase
+def colliding_pairs(s, v, diameter, dT, counters=None):
+    speed = np.abs(v)
+    reach = 0.5*diameter + speed.sum(axis=1)*dT
+    i, j = candidate_pairs(s, reach)
+    if counters is not None: counters["candidate_pairs"] += len(i)
+    r = s[j] - s[i]
+    vf = speed[i] + speed[j]
+    LIMIT = 0.5*diameter[i] + 0.5*diameter[j] + np.hypot(vf[:,0], vf[:,1])*dT
+    hit = np.hypot(r[:,0], r[:,1]) <= LIMIT
+    return i[hit], j[hit]
+
+# ________________________ Grouping colliding pairs
+class UnionFind:
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root: root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj: self.parent[max(ri, rj)] = min(ri, rj)
+
+# Lists of indices of objects that collide with each other this step, one list per cluster.
+# Pair counts are added to counters (see Gravitation.counters) when given.
+def colliding_clusters(s, v, diameter, dT, counters=None):
+    i, j = colliding_pairs(s, v, diameter, dT, counters=counters)
+    if counters is not None: counters["colliding_pairs"] += len(i)
+    if len(i) == 0: return []
+    uf = UnionFind(len(s))
+    for a, b in zip(i.tolist(), j.tolist()):
+        uf.union(a, b)
+    clusters = {}
+    for k in sorted(set(i.tolist()) | set(j.tolist())):
+        clusters.setdefault(uf.find(k), []).append(k)
+    return list(clusters.values())
@@ -0,0 +1,193 @@
+import csv
+from collections import deque
+import numpy as np
+
+
+"""
+Conserved quantities of a system, used to check how well an integrator keeps to them.
+Pairs closer than the sum of their diameters exert no force on each other in either
+engine, so the potential energy of such a pair stays at its value at that distance,
+-G m1 m2/(D1 + D2). """
+
+
+# Positions, velocities, masses and diameters of a list of Mass instances
+def mass_arrays(system):
+    s = np.array([n.s for n in system], dtype=float).reshape(-1,2)
+    v = np.array([n.v for n in system], dtype=float).reshape(-1,2)
+    m = np.array([n.m for n in system], dtype=float)
+    diameter = np.array([n.real_diameter for n in system], dtype=float)
+    return s, v, m, diameter
+
+# The same for every object in a Gravitation instance, straight from the packed arrays of
+# the vector engine
+def state_arrays(Model_System):
+    if hasattr(Model_System, "pack"):
+        Model_System.pack()
+        return Model_System.s, Model_System.v, Model_System.m, Model_System.diameter
+    return mass_arrays(Model_System.current_system)
+
+def kinetic_energy(v, m):
+    return 0.5*float((m*(v*v).sum(axis=1)).sum())
+
+def potential_energy(s, m, diameter, G, chunk_size=1024):
+    U = 0.0
+    for start in range(0, len(s), chunk_size):
+        t = np.arange(start, min(start + chunk_size, len(s)))
+        r = s[None,:,:] - s[t,None,:]
+        dist = np.maximum(np.hypot(r[...,0], r[...,1]), diameter[t,None] + diameter[None,:])
+        counted = np.arange(len(s))[None,:] > t[:,None]
+        w = np.zeros_like(dist)
+        np.divide(m[t,None]*m[None,:], dist, out=w, where=counted)
+        U -= G*float(w.sum())
+    return U
+
+# Potential energy between every object of one set (s1, m1, d1) and every object of another
+def interaction_energy(s1, m1, d1, s2, m2, d2, G):
+    if len(s1) == 0 or len(s2) == 0: return 0.0
+    r = s2[None,:,:] - s1[:,None,:]
+    dist = np.maximum(np.hypot(r[...,0], r[...,1]), d1[:,None] + d2[None,:])
+    return -G*float((m1[:,None]*m2[None,:]/dist).sum())
+
+def momentum(v, m):
+    return (m[:,None]*v).sum(axis=0)
+
+def angular_momentum(s, v, m):
+    return float((m*(s[:,0]*v[:,1] - s[:,1]*v[:,0])).sum())
+
+# Total energy, momentum and angular momentum. The energy is left as None for systems
+# bigger than energy_limit, where the all-pairs sum would take longer than the run.
+def conserved_quantities(Model_System, G, energy_limit=20000):
+    s, v, m, diameter = state_arrays(Model_System)
+    E = None
+    if len(m) <= energy_limit: E = kinetic_energy(v, m) + potential_energy(s, m, diameter, G)
+    return {"energy": E, "momentum": momentum(v, m), "angular_momentum": angular_momentum(s, v, m),
+            "momentum_scale": float((m*np.hypot(v[:,0], v[:,1])).sum())}
+
+# Relative changes between two sets of conserved quantities. Momentum is measured against
+# the total |m v| of the system, as the net momentum itself is often close to zero.
+def drift(before, after):
+    out = {"energy": None}
+    if before["energy"] is not None and after["energy"] is not None and before["energy"] != 0:
+        out["energy"] = abs(after["energy"] - before["energy"])/abs(before["energy"])
+    scale = before["momentum_scale"] if before["momentum_scale"] > 0 else 1
+    out["momentum"] = float(np.hypot(*(after["momentum"] - before["momentum"])))/scale
+    if before["angular_momentum"] != 0:
+        out["angular_momentum"] = abs(after["angular_momentum"] - before["angular_momentum"])/abs(before["angular_momentum"])
+    else: out["angular_momentum"] = None
+    return out
+
+
+"""
+Conservation samples the energy, momentum and angular momentum of a running simulation every
+few frames (Simulation.DIAGNOSTICS_EVERY) into a time series, kept in memory for the latest
+history samples and, given an output path, streamed to a CSV file as it grows.
+
+A sample is taken straight after the first force evaluation of a frame, and the potential
+energy comes from that pass whenever the engine can provide it (Gravitation from the
+distances in r_mag, the vector engine's single process direct solver alongside the
+accelerations, in the last force pass of the frame before when its integrator leaves
+the forces fresh). Otherwise it is summed over all pairs for systems up to energy_limit
+objects, and left out above that.
+
+Merges (combine_removed_masses), objects leaving the region restrict_system_size keeps and
+objects added by inject change the totals in one go. The engines report every such event
+through replaced, and the changes are added up as jumps. The drift columns are the changes
+since the first sample with the jumps taken out, relative to the first sample, so they
+measure the integration error alone. """
+class Conservation:
+
+    COLUMNS = ("frame", "time_elapsed", "bodies", "kinetic", "potential", "energy", "momentum_x",
+               "momentum_y", "angular_momentum", "energy_jumps", "momentum_x_jumps", "momentum_y_jumps",
+               "angular_momentum_jumps", "events", "energy_drift", "momentum_drift", "angular_momentum_drift")
+
+    def __init__(self, G, every=10, energy_limit=20000, history=10**5, output=None):
+        assert every >= 1
+        self.G, self.every, self.energy_limit = G, every, energy_limit
+        self.rows = deque(maxlen=history)
+        self.output, self.file, self.writer = output, None, None
+        self.frames, self.first = 0, None
+        self.jumps = {"energy": 0.0, "momentum": np.zeros(2), "angular_momentum": 0.0, "events": 0}
+        self.max_drift = {"energy": None, "momentum": 0.0, "angular_momentum": None}
+
+    # True on the frames a sample is taken, counting frames as it is asked
+    def due(self):
+        self.frames += 1
+        return (self.frames - 1) % self.every == 0
+
+    # True when the next frame asked about will be sampled, without counting a frame
+    def due_next(self):
+        return self.frames % self.every == 0
+
+    # ________________________ Discrete changes
+    # Objects removed replaced by objects added, with others left as they were. Each set is
+    # (s, v, m, diameter) as from mass_arrays.
+    def replaced(self, removed, added, others):
+        (s1, v1, m1, d1), (s2, v2, m2, d2), (s, _, m, d) = removed, added, others
+        G = self.G
+        self.jumps["energy"] += (kinetic_energy(v2, m2) - kinetic_energy(v1, m1)
+                                 + potential_energy(s2, m2, d2, G) + interaction_energy(s2, m2, d2, s, m, d, G)
+                                 - potential_energy(s1, m1, d1, G) - interaction_energy(s1, m1, d1, s, m, d, G))
+        self.jumps["momentum"] += momentum(v2, m2) - momentum(v1, m1)
+        self.jumps["angular_momentum"] += angular_momentum(s2, v2, m2) - angular_momentum(s1, v1, m1)
+        self.jumps["events"] += 1
+
+    def replaced_masses(self, removed, added, others):
+        self.replaced(mass_arrays(removed), mass_arrays(added), mass_arrays(others))
+
+    # ________________________ Sampling
+    def sample(self, time_elapsed, Model_System):
+        s, v, m, diameter = state_arrays(Model_System)
+        U = Model_System.pass_potential()
+        if U is None and len(m) <= self.energy_limit: U = potential_energy(s, m, diameter, self.G)
+        K, p, L = kinetic_energy(v, m), momentum(v, m), angular_momentum(s, v, m)
+        Model_System.p_total = [float(p[0]), float(p[1])]
+        jumps = self.jumps
+        row = {"frame": self.frames - 1, "time_elapsed": time_elapsed, "bodies": len(m), "kinetic": K, "potential": U,
+               "energy": None if U is None else K + U, "momentum_x": float(p[0]), "momentum_y": float(p[1]),
+               "angular_momentum": L, "energy_jumps": jumps["energy"], "momentum_x_jumps": float(jumps["momentum"][0]),
+               "momentum_y_jumps": float(jumps["momentum"][1]), "angular_momentum_jumps": jumps["angular_momentum"],
+               "events": jumps["events"]}
+        if self.first is None:
+            self.first = dict(row, momentum_scale=float((m*np.hypot(v[:,0], v[:,1])).sum()))
+        self.drifts(row)
+        self.rows.append(row)
+        if self.output is not None: self.write(row)
+        return row
+
+    # Changes since the first sample not explained by jumps, relative to the first sample
+    def drifts(self, row):
+        first, out = self.first, {}
+        out["energy"] = None
+        if row["energy"] is not None and first["energy"] is not None and first["energy"] != 0:
+            change = row["energy"] - row["energy_jumps"] - (first["energy"] - first["energy_jumps"])
+            out["energy"] = abs(change)/abs(first["energy"])
+        change = [row[k] - row[k + "_jumps"] - (first[k] - first[k + "_jumps"]) for k in ("momentum_x", "momentum_y")]
+        out["momentum"] = float(np.hypot(*change))/(first["momentum_scale"] if first["momentum_scale"] > 0 else 1)
+        out["angular_momentum"] = None
+        if first["angular_momentum"] != 0:
+            change = row["angular_momentum"] - row["angular_momentum_jumps"] - (first["angular_momentum"] - first["angular_momentum_jumps"])
+            out["angular_momentum"] = abs(change)/abs(first["angular_momentum"])
+        for key, value in out.items():
+            row[key + "_drift"] = value
+            if value is not None: self.max_drift[key] = max(value, self.max_drift[key] or 0.0)
+
+    # ________________________ Output
+    def write(self, row):
+        if self.writer is None:
+            self.file = open(self.output, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=self.COLUMNS, extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None: self.file.close()
+        self.file, self.writer = None, None
+
+    def summary(self):
+        last = self.rows[-1] if len(self.rows) > 0 else {}
+        return {"samples": len(self.rows), "every": self.every, "events": self.jumps["events"],
+                "energy_drift": last.get("energy_drift"), "momentum_drift": last.get("momentum_drift"),
+                "angular_momentum_drift": last.get("angular_momentum_drift"),
+                "max_energy_drift": self.max_drift["energy"], "max_momentum_drift": self.max_drift["momentum"],
+                "max_angular_momentum_drift": self.max_drift["angular_momentum"]}
@@ -0,0 +1,211 @@
+import os
+import csv
+import math
+import json
+import time
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from scenarios import load_scenario, copy_system
+import diagnostics
+from analysis import OrbitAnalysis
+
+
+"""
+Ensembles run many variants (members) of one scenario headless, in a pool of processes,
+and report one row per member as soon as it finishes:
+
+    python -m ensemble --grid v_scale.3=0.98,1,1.02 --grid TIME_STEP=1000,3000 --years 10 --output sweep.csv
+    python -m ensemble --sample v_scale.5=uniform:0.9:1.1 --sample inject_m=loguniform:1e27:1e30 \
+                       --members 200 --years 50 --output sample.csv
+
+(from inside project_folder). A member is a dict of parameters:
+
+    TIME_STEP, SUB_STEPS, INTEGRATOR, SOLVER, THETA, ...   Simulation settings
+    v_scale.k, m_scale.k                                     velocity / mass of object k times this
+    inject_m, inject_x, inject_y, inject_vx, inject_vy       one extra mass (kg, AU, m/s), as event_loop adds
+
+Every member starts from the same base system (a scenario from scenarios.py) with Mass IDs
+counted from 0, so object k is the same object in every member. Objects outside the region
+restrict_system_size keeps are dropped before the run starts. Each row has the member's
+parameters, the objects left, the collisions (merges) and ejections (objects removed by
+restrict_system_size) along the way, and the energy, momentum and angular momentum drift of
+the run; a member is stable if it had neither collisions nor ejections. The orbit analysis
+(analysis.py, sampled every ANALYSIS_EVERY frames) adds the objects left unbound from the
+heaviest object, the ejections and captures it saw and the close approaches. """
+
+ANALYSIS_EVERY = 10
+RANDOM = {"uniform": lambda rng, lo, hi: rng.uniform(lo, hi),
+          "loguniform": lambda rng, lo, hi: 10**rng.uniform(math.log10(lo), math.log10(hi)),
+          "normal": lambda rng, mean, sd: rng.normal(mean, sd)}
+
+
+# ________________________ Members
+# Every combination of the values given for each parameter
+def grid(values):
+    keys = list(values)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*[values[k] for k in keys])]
+
+# count members with each parameter drawn from (distribution, a, b), see RANDOM
+def sample(spec, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{k: float(RANDOM[d](rng, a, b)) for k, (d, a, b) in spec.items()} for _ in range(count)]
+
+def build_system(base, params):
+    Mass.id = 0
+    system = copy_system(base) if isinstance(base, list) else \
+             load_scenario(base.get("scenario", "solar_system"), n=base.get("n"), seed=base.get("seed", 0))
+    for key, value in params.items():
+        if key.startswith("v_scale."):
+            n = system[int(key.split(".")[1])]
+            n.v = [value*float(n.v[0]), value*float(n.v[1])]
+        elif key.startswith("m_scale."):
+            n = system[int(key.split(".")[1])]
+            n.m = value*n.m
+            n.dot_diameter, n.real_diameter = n.calc_sphere_diam()
+    if "inject_m" in params:
+        system.append(Mass(m=params["inject_m"], s=[params.get("inject_x", 0)*Simulation.AU,
+                                                     params.get("inject_y", 0)*Simulation.AU],
+                           v=[params.get("inject_vx", 0), params.get("inject_vy", 0)],
+                           colour=(255,70,110), avg_density=1400))
+    return system
+
+# One member from start to finish, run in a pool process
+def run_member(index, base, params, steps=None, duration=None, energy_limit=20000):
+    system = build_system(base, params)
+    sim = Simulation(input=system)
+    for key, value in params.items():
+        if key.isupper(): setattr(sim, key, value)
+    Model_System = sim.build_model()
+    Model_System.object_locale_data()
+    Model_System.restrict_system_size(Model_System.current_system)
+    initial = set([n.ID for n in Model_System.current_system])
+    before = diagnostics.conserved_quantities(Model_System, sim.G, energy_limit=energy_limit)
+    analysis = OrbitAnalysis(sim.G, every=ANALYSIS_EVERY)
+    start = time.perf_counter()
+    Model_System = sim.simulate(steps=steps, duration=duration, Model_System=Model_System, analysis=analysis)
+    wall_time = time.perf_counter() - start
+    after = diagnostics.conserved_quantities(Model_System, sim.G, energy_limit=energy_limit)
+    final = set([n.ID for n in Model_System.current_system])
+    merged = set([ID for ids, _ in Model_System.merges for ID in ids])
+    created = set([new for _, new in Model_System.merges])
+    ejected = (initial | created) - final - merged
+    drift = diagnostics.drift(before, after)
+    analysis.close()
+    orbits = analysis.summary()
+    row = {"member": index}
+    row.update(params)
+    row.update({"bodies_initial": len(initial), "bodies_final": len(final),
+                "collisions": len(Model_System.merges), "ejections": len(ejected),
+                "ejected_ids": " ".join([str(ID) for ID in sorted(ejected)]),
+                "energy_drift": drift["energy"], "momentum_drift": drift["momentum"],
+                "angular_momentum_drift": drift["angular_momentum"],
+                "stable": len(Model_System.merges) == 0 and len(ejected) == 0,
+                "unbound_ids": " ".join([str(ID) for ID in orbits["unbound"]]),
+                "unbindings": orbits["events"]["ejection"], "captures": orbits["events"]["capture"],
+                "close_approaches": orbits["events"]["close_approach"],
+                "steps": sim.steps_taken, "years": sim.time_elapsed/(365*24*3600), "wall_time": wall_time})
+    return row
+
+# ________________________ Running
+# Rows of members as they finish (not in member order). A member that fails gives a row with
+# its parameters and the error instead, and the other members carry on. With an output path,
+# rows are also appended to that CSV file as they come in; its columns are those of the first
+# member that finished, so rows of members failing before then wait for it.
+def run_ensemble(base, members, steps=None, duration=None, workers=None, output=None, energy_limit=20000):
+    assert steps is not None or duration is not None
+    writer, f, waiting = None, None, []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(run_member, k, base, params, steps, duration, energy_limit): (k, params)
+                   for k, params in enumerate(members)}
+        try:
+            for future in as_completed(futures):
+                try:
+                    row = dict(future.result(), error="")
+                except Exception as e:
+                    k, params = futures[future]
+                    row = dict({"member": k}, **params)
+                    row["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+                if output is not None:
+                    waiting.append(row)
+                    if writer is None and row["error"] == "": writer, f = ensemble_writer(output, row)
+                    if writer is not None:
+                        for waiting_row in waiting: writer.writerow(waiting_row)
+                        waiting = []
+                        f.flush()
+                yield row
+            if len(waiting) > 0:                 # Every member failed
+                writer, f = ensemble_writer(output, waiting[0])
+                for waiting_row in waiting: writer.writerow(waiting_row)
+        finally:
+            if f is not None: f.close()
+            for future in futures: future.cancel()
+
+def ensemble_writer(output, row):
+    f = open(output, "w", newline="")
+    writer = csv.DictWriter(f, fieldnames=list(row), extrasaction="ignore", restval="")
+    writer.writeheader()
+    return writer, f
+
+# name=v1,v2,... into (name, [values]) and name=distribution:a:b into (name, (distribution, a, b))
+def parse_value(text):
+    for convert in (int, float):
+        try: return convert(text)
+        except ValueError: pass
+    return text
+
+def parse_grid(items):
+    return {name: [parse_value(v) for v in values.split(",")]
+            for name, values in [item.split("=", 1) for item in items]}
+
+def parse_sample(items):
+    spec = {}
+    for name, value in [item.split("=", 1) for item in items]:
+        distribution, a, b = value.split(":")
+        assert distribution in RANDOM, distribution
+        spec[name] = (distribution, float(a), float(b))
+    return spec
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run many variants of a scenario in parallel.")
+    parser.add_argument("--scenario", default="solar_system", help="name in scenarios.SCENARIOS or a scenario file")
+    parser.add_argument("--n", type=int, default=None, help="objects in a generated scenario (default: scenarios.GENERATED_N)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of a generated scenario")
+    parser.add_argument("--grid", action="append", default=[], help="name=v1,v2,... (every combination)")
+    parser.add_argument("--sample", action="append", default=[], help="name=uniform|loguniform|normal:a:b")
+    parser.add_argument("--members", type=int, default=100, help="number of sampled members")
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=None, help="frames per member")
+    parser.add_argument("--years", type=float, default=None, help="simulated years per member")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--output", default=None, help="CSV file the rows are streamed into")
+    args = parser.parse_args(argv)
+    if args.steps is None and args.years is None:
+        parser.error("one of --steps or --years is required")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    members = grid(parse_grid(args.grid)) if args.grid else [{}]
+    if args.sample:
+        sampled = sample(parse_sample(args.sample), args.members, seed=args.sample_seed)
+        members = [dict(g, **s) for g in members for s in sampled]
+    base = {"scenario": args.scenario, "n": args.n, "seed": args.seed}
+    duration = args.years*365*24*3600 if args.years is not None else None
+    rows = []
+    for row in run_ensemble(base, members, steps=args.steps, duration=duration,
+                            workers=args.workers, output=args.output):
+        rows.append(row)
+        print(json.dumps(row))
+    done = [row for row in rows if row["error"] == ""]
+    print("%d members, %d stable, %d with collisions, %d with ejections, %d failed" % (
+        len(rows), sum([row["stable"] for row in done]), sum([row["collisions"] > 0 for row in done]),
+        sum([row["ejections"] > 0 for row in done]), len(rows) - len(done)))
+    return rows
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from scenarios import load_scenario
+from checkpoint import save_checkpoint, load_checkpoint
+from journal import load_journal
+
+
+"""
+Checks of the results that are meant to come out bit for bit the same however a run is
+carried out:
+
+    python -m exactness                       every check, exit code 1 if any fails
+    python -m exactness --check checkpoint    only the checks whose name contains this
+
+(from inside project_folder). Each check runs the same simulation two ways and compares
+the final IDs, positions, velocities and masses of every object and tracer, the Mass.id and
+tracer ID counters, the absorbed tracer count and the elapsed time:
+
+    checkpoint           straight through, and saved, restored and carried on halfway
+    checkpoint-drained   the same with every tracer dropped just before the save
+    checkpoint-classic   the same on the classic engine (Euler, no tracers) with the Solar
+                         System, whose outermost planet restrict_system_size drops on frame
+                         two, saved after each of the first few frames
+    workers              with WORKERS = 1 and WORKERS = 2
+    journal              a session with masses added between frames, and its journal replayed """
+
+
+# Everything compared between two runs
+def final_state(sim, Model_System):
+    ids, s, v, m, _, _ = Model_System.snapshot_arrays()
+    order = np.argsort(ids, kind="stable")
+    tracers = getattr(Model_System, "tracers", None)
+    return {"ids": ids[order], "s": s[order], "v": v[order], "m": m[order], "mass_id": Mass.id,
+            "tracer_next_id": None if tracers is None else tracers.next_id,
+            "tracers_absorbed": Model_System.counters.get("tracers_absorbed", 0), "time_elapsed": sim.time_elapsed}
+
+# Names of the quantities that differ
+def differences(a, b):
+    return [k for k in a if not (np.array_equal(a[k], b[k]) if isinstance(a[k], np.ndarray) else a[k] == b[k])]
+
+def new_simulation(scenario, n, settings):
+    Mass.id = 0
+    sim = Simulation(input=load_scenario(scenario, n=n, seed=0))
+    for k, value in settings.items(): setattr(sim, k, value)
+    sim.apply_units()
+    return sim
+
+def drain(Model_System):
+    Model_System.tracers.keep(np.zeros(len(Model_System.tracers), dtype=bool))
+
+# ________________________ Checks
+def check_checkpoint(scenario, n, settings, steps, folder, drained=False, split=None):
+    if split is None: split = steps//2
+    sim = new_simulation(scenario, n, settings)
+    Model_System = sim.build_model()
+    sim.simulate(steps=split, Model_System=Model_System)
+    if drained: drain(Model_System)
+    sim.simulate(steps=steps - split, Model_System=Model_System)
+    straight = final_state(sim, Model_System)
+    Model_System.close()
+
+    sim = new_simulation(scenario, n, settings)
+    Model_System = sim.build_model()
+    sim.simulate(steps=split, Model_System=Model_System)
+    if drained: drain(Model_System)
+    path = os.path.join(folder, "exactness.npz")
+    save_checkpoint(path, sim, Model_System)
+    Model_System.close()
+    Mass.id = -1                                 # Must come back from the checkpoint
+    sim, Model_System = load_checkpoint(path)
+    sim.simulate(steps=steps - split, Model_System=Model_System)
+    resumed = final_state(sim, Model_System)
+    Model_System.close()
+    return differences(straight, resumed)
+
+def check_checkpoint_classic(scenario, n, settings, steps, folder):
+    settings = dict(settings, ENGINE="classic", INTEGRATOR="euler", TRACERS=0)
+    wrong = set()
+    for split in (1, 2, 3, steps//2):
+        wrong.update(check_checkpoint("solar_system", None, settings, steps, folder, split=split))
+    return sorted(wrong)
+
+def check_workers(scenario, n, settings, steps, folder):
+    states = []
+    for workers in (1, 2):
+        sim = new_simulation(scenario, n, dict(settings, WORKERS=workers))
+        Model_System = sim.build_model()
+        sim.simulate(steps=steps, Model_System=Model_System)
+        states.append(final_state(sim, Model_System))
+        Model_System.close()
+    return differences(*states)
+
+# Masses added every so many frames, the way Main.event_loop adds them, then the journal
+# replayed as python -m journal does it
+def check_journal(scenario, n, settings, steps, folder):
+    path = os.path.join(folder, "exactness.journal")
+    sim = new_simulation(scenario, n, dict(settings, JOURNAL=path, SCENARIO=scenario, SCENARIO_N=n, SCENARIO_SEED=0))
+    Model_System = sim.build_model()
+    rng = np.random.default_rng(0)
+    for frame in range(steps):
+        if frame % max(1, steps//4) == 1:
+            Model_System.inject(Mass(m=float(10**rng.uniform(22, 26)), s=(Simulation.AU*rng.uniform(-2, 2, 2)).tolist(),
+                                     v=rng.uniform(-3e4, 3e4, 2).tolist(), colour=(255,70,110), avg_density=1400))
+        sim.step(Model_System)
+        sim.clock_tick(Model_System)
+    Model_System.close()
+    session = final_state(sim, Model_System)
+
+    sim, Model_System, player = load_journal(path)
+    sim.simulate(duration=player.end_time - 0.5*Model_System.frame_dT, Model_System=Model_System, player=player)
+    player.apply(sim, Model_System)
+    Model_System.close()
+    return differences(session, final_state(sim, Model_System))
+
+CHECKS = {"checkpoint": check_checkpoint,
+          "checkpoint-drained": lambda *args: check_checkpoint(*args, drained=True),
+          "checkpoint-classic": check_checkpoint_classic,
+          "workers": check_workers,
+          "journal": check_journal}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that resumed, sharded and replayed runs match straight ones exactly.")
+    parser.add_argument("--check", action="append", default=None, help="only run checks whose name contains this")
+    parser.add_argument("--scenario", default="disk", help="name in scenarios.SCENARIOS or a scenario file")
+    parser.add_argument("--n", type=int, default=200, help="objects in a generated scenario")
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--integrator", choices=("euler", "leapfrog", "yoshida4", "rk4", "block"), default="leapfrog")
+    parser.add_argument("--tracers", type=int, default=50)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = {"INTEGRATOR": args.integrator, "TRACERS": args.tracers}
+    failed = 0
+    with tempfile.TemporaryDirectory() as folder:
+        for name, check in CHECKS.items():
+            if args.check is not None and not any(k in name for k in args.check): continue
+            wrong = check(args.scenario, args.n, settings, args.steps, folder)
+            print("%-20s %s" % (name, "ok" if len(wrong) == 0 else "DIFFERENT: " + ", ".join(wrong)))
+            failed += len(wrong) > 0
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import argparse
+import csv
+import json
+from simulation import Simulation
+from recorder import TrajectoryRecorder
+from checkpoint import Checkpointer, load_checkpoint
+from profiler import Profiler
+from scenarios import load_scenario
+from diagnostics import Conservation
+from analysis import OrbitAnalysis, write_columns
+
+
+"""
+Running the simulation without pygame, e.g. on a compute box:
+
+    python -m headless --years 100 --state final_state.csv --summary summary.json
+
+(from inside project_folder). The run steps Gravitation as fast as it can for the
+requested number of steps or simulated years, then writes the final state of every
+object and a summary of the run. """
+
+YEAR = 365*24*3600
+
+
+# Final position, velocity and physical data of every object, one row per object
+def write_state(path, Model_System):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "m", "x", "y", "vx", "vy", "avg_density", "real_diameter", "colour"])
+        for n in Model_System.current_system:
+            writer.writerow([n.ID, n.m, float(n.s[0]), float(n.s[1]), float(n.v[0]), float(n.v[1]),
+                             n.avg_density, n.real_diameter, "%d,%d,%d" % tuple(n.colour)])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the orbit simulation without a display.")
+    parser.add_argument("--steps", type=int, default=None, help="number of frames to take")
+    parser.add_argument("--years", type=float, default=None, help="simulated duration in years")
+    parser.add_argument("--engine", choices=("vector", "classic"), default=Simulation.ENGINE)
+    parser.add_argument("--solver", choices=("direct", "barnes_hut"), default=Simulation.SOLVER)
+    parser.add_argument("--theta", type=float, default=Simulation.THETA)
+    parser.add_argument("--integrator", choices=("euler", "leapfrog", "yoshida4", "rk4", "block"),
+                        default=Simulation.INTEGRATOR)
+    parser.add_argument("--time-step", type=float, default=Simulation.TIME_STEP,
+                        help="simulated seconds per frame")
+    parser.add_argument("--sub-steps", type=int, default=Simulation.SUB_STEPS, help="steps per frame")
+    parser.add_argument("--tracers", type=int, default=Simulation.TRACERS,
+                        help="massless tracers in a belt round the heaviest object")
+    parser.add_argument("--workers", type=int, default=Simulation.WORKERS,
+                        help="processes sharing each force evaluation")
+    parser.add_argument("--scenario", default=Simulation.SCENARIO,
+                        help="name in scenarios.SCENARIOS or a .json, .toml or .npz scenario file")
+    parser.add_argument("--n", type=int, default=None, help="objects in a generated scenario (default: scenarios.GENERATED_N)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of a generated scenario")
+    parser.add_argument("--center", type=int, default=None, help="ID of the object to follow")
+    parser.add_argument("--state", default=None, help="CSV file for the final state")
+    parser.add_argument("--summary", default=None, help="JSON file for the summary statistics")
+    parser.add_argument("--record", default=None, help="directory to record the trajectory into")
+    parser.add_argument("--stride", type=int, default=1, help="record every stride frames")
+    parser.add_argument("--checkpoint", default=None, help="file to keep an up to date checkpoint in")
+    parser.add_argument("--checkpoint-every", type=int, default=None, help="checkpoint every N frames")
+    parser.add_argument("--checkpoint-minutes", type=float, default=10,
+                        help="checkpoint every N minutes of wall clock time")
+    parser.add_argument("--profile", default=None,
+                        help="time every Gravitation method and write the profile to this .json or .csv file")
+    parser.add_argument("--diagnostics", default=None,
+                        help="CSV file the energy, momentum and angular momentum samples are streamed to")
+    parser.add_argument("--diagnostics-every", type=int, default=10, help="frames between diagnostics samples")
+    parser.add_argument("--analysis", default=None,
+                        help="orbital elements of every object, summed up per object into this .npz, .csv or .parquet file")
+    parser.add_argument("--events", default=None,
+                        help="CSV file the ejections, captures, close approaches and merges are streamed to")
+    parser.add_argument("--analysis-every", type=int, default=1, help="frames between orbit analysis samples")
+    parser.add_argument("--approach", type=float, default=0.05, help="close approach distance in AU")
+    parser.add_argument("--resume", default=None, help="checkpoint to carry on from; --years is then "
+                                                        "the total simulated time including the resumed part")
+    args = parser.parse_args(argv)
+    if args.steps is None and args.years is None:
+        parser.error("one of --steps or --years is required")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume is not None:
+        sim, Model_System = load_checkpoint(args.resume)
+    else:
+        system = load_scenario(args.scenario, n=args.n, seed=args.seed)
+        sim = Simulation(input=system, center_object_ID=args.center)
+        sim.SCENARIO, sim.SCENARIO_N, sim.SCENARIO_SEED = args.scenario, args.n, args.seed
+        sim.ENGINE, sim.SOLVER, sim.THETA = args.engine, args.solver, args.theta
+        sim.INTEGRATOR, sim.TIME_STEP, sim.SUB_STEPS = args.integrator, args.time_step, args.sub_steps
+        sim.WORKERS, sim.TRACERS = args.workers, args.tracers
+        Model_System = sim.build_model()
+    if args.diagnostics is not None:
+        sim.monitor = Conservation(sim.G, every=args.diagnostics_every, output=args.diagnostics)
+        Model_System.monitor = sim.monitor
+    if args.profile is not None: sim.profiler = Profiler(sim.PHASES)
+    duration = args.years*YEAR if args.years is not None else None
+    recorder = TrajectoryRecorder(args.record, stride=args.stride) if args.record is not None else None
+    analysis = None
+    if args.analysis is not None or args.events is not None:
+        analysis = OrbitAnalysis(sim.G, primary_ID=sim.center_object_ID, approach=args.approach*sim.AU,
+                                 every=args.analysis_every, events=args.events)
+    checkpointer = None
+    if args.checkpoint is not None:
+        checkpointer = Checkpointer(args.checkpoint, every_frames=args.checkpoint_every,
+                                    every_seconds=60*args.checkpoint_minutes)
+    Model_System = sim.simulate(steps=args.steps, duration=duration, Model_System=Model_System,
+                                recorder=recorder, checkpointer=checkpointer, analysis=analysis)
+    if recorder is not None: recorder.close()
+    Model_System.close()
+    if sim.monitor is not None: sim.monitor.close()
+    summary = sim.summary(Model_System)
+    if analysis is not None:
+        analysis.close()
+        summary["orbits"] = analysis.summary()
+        if args.analysis is not None: write_columns(args.analysis, analysis.bodies())
+    if args.state is not None: write_state(args.state, Model_System)
+    if args.profile is not None: sim.profiler.export(args.profile)
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 
+import numpy as np
 from mass import *
 import random 
 def pygame_array(list1, list2, WIDTH, HEIGHT):
@@ -9,6 +10,13 @@ def pygame_array(list1, list2, WIDTH, HEIGHT):
         scaled_coordinates.append((x, y))
     return scaled_coordinates
 
+# Same mapping as pygame_array for an (N, 2) array of positions at once
+def pygame_points(positions, WIDTH, HEIGHT):
+    points = np.empty_like(positions, dtype=float)
+    points[:,0] = 0.5*WIDTH*positions[:,0] + 0.5*WIDTH     # +/- x shift
+    points[:,1] = -0.5*WIDTH*positions[:,1] + 0.5*HEIGHT   # +/- y shift
+    return points
+
 def translate_points_on_screen(pts=(0, 0), WIDTH=1, HEIGHT=1, screen_scale=1):
     position = []
     x = pts[0]/(0.5*WIDTH) -1
@@ -0,0 +1,85 @@
+"""
+Integrators for the vector engine. Each one advances a model's s and v arrays in place by h
+seconds, starting from model.g (the acceleration at the current positions) and calling
+model.accelerations(s=...) for any further force evaluations it needs. The return value
+says whether model.g is still the acceleration at the new positions, in which case the
+next g_vectors call can skip its force evaluation. The last model.accelerations() call at
+the current positions over every body is then the one that sums the potential energy for
+a diagnostics sample (model.potential_wanted).
+
+    euler     1st order, semi-implicit (what calc_velocity/reposition do)  1 force evaluation
+    leapfrog  2nd order, symplectic kick-drift-kick (velocity Verlet)       1 force evaluation
+    yoshida4  4th order, symplectic, three leapfrog steps (triple jump)     3 force evaluations
+    rk4       4th order Runge-Kutta, not symplectic                         4 force evaluations
+    block     leapfrog with individual power-of-two timesteps per body      forces only for bodies due
+"""
+import numpy as np
+
+CBRT2 = 2**(1/3)
+YOSHIDA_WEIGHTS = (1/(2 - CBRT2), -CBRT2/(2 - CBRT2), 1/(2 - CBRT2))
+
+
+def euler(model, h):
+    model.v += model.g*h
+    model.s += model.v*h
+    return False
+
+def leapfrog(model, h):
+    model.v += 0.5*h*model.g
+    model.s += h*model.v
+    model.g = model.accelerations()
+    model.v += 0.5*h*model.g
+    return True
+
+def yoshida4(model, h):
+    wanted = model.potential_wanted
+    for k, w in enumerate(YOSHIDA_WEIGHTS):
+        model.potential_wanted = wanted and k == len(YOSHIDA_WEIGHTS) - 1
+        leapfrog(model, w*h)
+    return True
+
+def rk4(model, h):
+    s0, v0 = model.s.copy(), model.v.copy()
+    k1s, k1v = v0, model.g
+    k2s, k2v = v0 + 0.5*h*k1v, model.accelerations(s=s0 + 0.5*h*k1s)
+    k3s, k3v = v0 + 0.5*h*k2v, model.accelerations(s=s0 + 0.5*h*k2s)
+    k4s, k4v = v0 + h*k3v, model.accelerations(s=s0 + h*k3s)
+    model.s[:] = s0 + h/6*(k1s + 2*k2s + 2*k3s + k4s)
+    model.v[:] = v0 + h/6*(k1v + 2*k2v + 2*k3v + k4v)
+    return False
+
+# Hierarchical block timesteps. At the start of each step every body is given its own step
+# h/2**level, the largest power-of-two fraction of h below eta*sqrt(r_nn/|g|), where r_nn is
+# its nearest neighbour distance. The step is then walked through in ticks of the smallest
+# step: all bodies drift every tick (so forces see up to date positions), but only the bodies
+# whose own step starts or ends on a tick are kicked, and only those ending one have their
+# forces recomputed. All bodies are back in sync, with fresh forces, at the end of the step.
+# When every body is on level 0 that is a leapfrog step, which is taken as such. The nearest
+# neighbour distances come from the force pass that closed the step before (model.nearest).
+def block_levels(model, h):
+    g_mag = np.hypot(model.g[:,0], model.g[:,1])
+    dt = np.full(len(g_mag), np.inf)
+    np.divide(model.block_eta*np.sqrt(model.nearest()), np.sqrt(g_mag), out=dt, where=g_mag > 0)
+    with np.errstate(divide='ignore'):
+        level = np.ceil(np.log2(h/dt))
+    return np.clip(level, 0, model.block_levels).astype(np.int64)
+
+def block(model, h):
+    level = block_levels(model, h)
+    top = int(level.max()) if len(level) > 0 else 0
+    if top == 0: return leapfrog(model, h)
+    ticks = 2**top
+    period = 2**(top - level)                  # ticks per step of each body
+    dt = h/2.0**level
+    model.v += 0.5*dt[:,None]*model.g
+    for tick in range(1, ticks + 1):
+        model.s += (h/ticks)*model.v
+        due = np.flatnonzero(tick % period == 0)
+        if len(due) == 0: continue
+        model.g[due] = model.accelerations(targets=due if len(due) < len(level) else None)
+        kick = 0.5*dt[due,None]*model.g[due]
+        if tick < ticks: kick *= 2             # closing half kick and the next opening half kick
+        model.v[due] += kick
+    return True
+
+INTEGRATORS = {"euler": euler, "leapfrog": leapfrog, "yoshida4": yoshida4, "rk4": rk4, "block": block}
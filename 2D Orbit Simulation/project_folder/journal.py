@@ -0,0 +1,148 @@
+import json
+import argparse
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from scenarios import load_scenario
+from recorder import TrajectoryRecorder
+from headless import write_state, YEAR
+from ensemble import parse_value
+
+
+"""
+An input journal records everything a user adds to a simulation by hand, so the session
+can be run again without a display, exactly or with other settings:
+
+    python -m journal session.journal --state final.csv --summary summary.json
+    python -m journal session.journal --set INTEGRATOR=leapfrog --set SUB_STEPS=8 --record run
+
+(from inside project_folder). The file is one line of JSON (format version, scenario with the
+n and seed it was generated with, first Mass ID, center object, program constants, seed) followed by fixed size ENTRY records: one
+per mass added through Gravitation.inject, written and flushed the moment it is added, and
+one at the end of the session. Each entry holds the number of frames stepped before it and
+the simulated time they took, frames*frame_dT. The replayer adds every mass before the
+first frame whose start is within half a frame of its time, so with the recorded settings
+it lands between the same two frames, and with another TIME_STEP as close as that allows.
+Masses keep their recorded IDs. """
+
+ENTRY = np.dtype([("kind", "u1"), ("frame", "<i8"), ("time", "<f8"), ("ID", "<i8"), ("m", "<f8"),
+                  ("s", "<f8", (2,)), ("v", "<f8", (2,)), ("colour", "u1", (3,)), ("avg_density", "<f8")])
+INJECT, END = 0, 1
+VERSION = 1
+
+
+"""
+Journal writes the journal of one session. Simulation.build_model hands it to Gravitation
+when JOURNAL is set, and Gravitation tells it of every mass injected. """
+class Journal:
+
+    def __init__(self, path, sim):
+        self.path = path
+        settings = {k: v for k, v in sim.settings().items() if k != "JOURNAL"}
+        header = {"version": VERSION, "scenario": sim.SCENARIO, "scenario_n": sim.SCENARIO_N,
+                  "scenario_seed": sim.SCENARIO_SEED,
+                  "first_id": min([n.ID for n in sim.input], default=Mass.id),
+                  "center_object_ID": sim.center_object_ID, "seed": sim.SEED, "settings": settings}
+        self.file = open(path, "wb")
+        self.file.write((json.dumps(header) + "\n").encode())
+        self.file.flush()
+
+    def write(self, kind, frames, frame_dT, M=None):
+        entry = np.zeros(1, dtype=ENTRY)
+        entry["kind"], entry["frame"], entry["time"] = kind, frames, frames*frame_dT
+        if M is not None:
+            entry["ID"], entry["m"], entry["avg_density"] = M.ID, M.m, M.avg_density
+            entry["s"], entry["v"], entry["colour"] = [float(n) for n in M.s], [float(n) for n in M.v], M.colour
+        self.file.write(entry.tobytes())
+        self.file.flush()
+
+    def injected(self, frames, frame_dT, M):
+        self.write(INJECT, frames, frame_dT, M)
+
+    def close(self, frames, frame_dT):
+        if self.file is None: return
+        self.write(END, frames, frame_dT)
+        self.file.close()
+        self.file = None
+
+
+# The header and entries of a journal. A record cut short (the session was killed while
+# writing it) is left out.
+def read_journal(path):
+    with open(path, "rb") as f:
+        header = json.loads(f.readline().decode())
+        data = f.read()
+    assert header["version"] == VERSION
+    usable = len(data) - len(data) % ENTRY.itemsize
+    return header, np.frombuffer(data[:usable], dtype=ENTRY)
+
+
+"""
+JournalPlayer adds the masses of a journal to a simulation as it goes. Simulation.simulate
+calls apply before every frame. """
+class JournalPlayer:
+
+    def __init__(self, entries):
+        self.injections = entries[entries["kind"] == INJECT]
+        ends = entries[entries["kind"] == END]
+        self.end_time = float(ends["time"][-1]) if len(ends) > 0 else \
+                        float(self.injections["time"][-1]) if len(self.injections) > 0 else 0.0
+        self.next = 0
+
+    def apply(self, sim, Model_System):
+        due = (sim.frames + 0.5)*Model_System.frame_dT
+        while self.next < len(self.injections) and self.injections["time"][self.next] < due:
+            entry = self.injections[self.next]
+            M = Mass(m=float(entry["m"]), s=entry["s"].tolist(), v=entry["v"].tolist(),
+                     colour=tuple(entry["colour"].tolist()), avg_density=float(entry["avg_density"]))
+            M.ID = int(entry["ID"])
+            Mass.id = max(Mass.id, M.ID + 1)
+            Model_System.inject(M)
+            self.next += 1
+
+# The Simulation and Gravitation a journal started from, with settings changed as given,
+# and the player that adds its masses
+def load_journal(path, overrides={}):
+    header, entries = read_journal(path)
+    Mass.id = header["first_id"]
+    system = load_scenario(header["scenario"], n=header.get("scenario_n"), seed=header.get("scenario_seed", 0))
+    sim = Simulation(input=system, center_object_ID=header["center_object_ID"])
+    for k, value in header["settings"].items(): setattr(sim, k, value)
+    for k, value in overrides.items(): setattr(sim, k, value)
+    sim.JOURNAL, sim.BACKGROUND_PHYSICS = None, False
+    sim.apply_units()
+    return sim, sim.build_model(), JournalPlayer(entries)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a recorded interactive session again without a display.")
+    parser.add_argument("journal", help="journal file written with JOURNAL set")
+    parser.add_argument("--set", action="append", default=[], help="NAME=value, a program constant to change")
+    parser.add_argument("--years", type=float, default=None,
+                        help="simulated years to run (default: as long as the session)")
+    parser.add_argument("--state", default=None, help="CSV file for the final state")
+    parser.add_argument("--summary", default=None, help="JSON file for the summary statistics")
+    parser.add_argument("--record", default=None, help="directory to record the trajectory into")
+    parser.add_argument("--stride", type=int, default=1, help="record every stride frames")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = {name: parse_value(value) for name, value in [item.split("=", 1) for item in args.set]}
+    sim, Model_System, player = load_journal(args.journal, overrides)
+    duration = args.years*YEAR if args.years is not None else player.end_time - 0.5*Model_System.frame_dT
+    recorder = TrajectoryRecorder(args.record, stride=args.stride) if args.record is not None else None
+    Model_System = sim.simulate(duration=duration, Model_System=Model_System, recorder=recorder, player=player)
+    player.apply(sim, Model_System)                      # Masses added after the last frame
+    if recorder is not None: recorder.close()
+    Model_System.close()
+    summary = sim.summary(Model_System)
+    summary["injected"] = player.next
+    if args.state is not None: write_state(args.state, Model_System)
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+if __name__ == "__main__":
+    main()
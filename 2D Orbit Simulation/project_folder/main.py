@@ -1,46 +1,25 @@
 import pygame
 from pygame.locals import*
+import time
 import random
-from mass import*
-from Newtonian_Grav import*
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from renderer import Renderer
+from worker import PhysicsWorker
+from recorder import TrajectoryReader
+from profiler import Profiler
+from trails import Trails
 import helper_functions
 
 
-class Main:         
-    # _______________________________________Physical Constants                  
-    AU, G = 1.496*10**11, 6.67430*10**-11    # Average distance between Sun and Earth # Newton's Gravitational Constant                                       
-    
-    # _______________________________________ Program constants
-    SCREEN_SCALE = 3                         # Number of AU either side of screen center / origin
-    DOT_SCALE = 1                            # Magnitude of size variation between dots representing objects       
-    TIME_LAPSE = 1                           # Rate of evolution| 0 - 1 = 0 to 100% of hardcoded evolution rate         
+class Main(Simulation):         
     SPACE_COLOUR = (0,0,10)  
-    assert SCREEN_SCALE > 0               
-    assert DOT_SCALE < 5 and DOT_SCALE >=1
-    assert TIME_LAPSE >= 0 and TIME_LAPSE <=1
+    REPLAY = None                            # Directory of a recorded run (see recorder.py) to play back
+    PROFILE_EXPORT = None                    # File (.json or .csv) the profile is written to on exit
+    TRAIL_LENGTH = 200                       # Positions kept per orbit trail| 0 = no trails
+    TRAIL_EVERY = 3                          # Frames between trail positions
 
-    # _______________________________________ Solar System Input                                                          
-    v_Earth = 29789                          # Velocity calculated assuming circular motion at average distance
-    v_Merc = 29789*(1/0.378)**0.5           
-    v_Ven = 29789*(1/0.72)**0.5             
-    v_Mar = 29789*(1/1.5)**0.5
-    v_Jup = 29789*(1/5.2)**0.5
-    v_Sat = 29789*(1/9.5)**0.5
-    v_Ura = 29789*(1/19)**0.5
-    v_Nep = 29789*(1/30)**0.5
-    Mass.distance_unit = SCREEN_SCALE*AU     
-    Mass.scale *= DOT_SCALE 
-    SOLAR_SYSTEM = [Mass(m=1.989*10**30, s=[0,0],       v=[0,0],      colour=(255,255,250), avg_density=1408),
-                    Mass(m=3.285*10**23, s=[0.378*AU,0],v=[0,v_Merc], colour=(200,180,0),   avg_density=5429),
-                    Mass(m=4.867*10**24, s=[0.72*AU,0], v=[0,v_Ven],  colour=(200,180,0),   avg_density=5243),
-                    Mass(m=5.972*10**24, s=[AU,0],      v=[0,v_Earth],colour=(80,180,255),  avg_density=5514),
-                    Mass(m=6.39*10**23,  s=[1.5*AU,0],  v=[0,v_Mar],  colour=(200,100,50),  avg_density=3934),
-                    Mass(m=1.898*10**27, s=[-5.2*AU,0], v=[0,-v_Jup], colour=(200,150,100), avg_density=1326),
-                    Mass(m=5.972*10**24, s=[9.5*AU,0],  v=[0,v_Sat],  colour=(150,150,70),  avg_density=687),
-                    Mass(m=8.681*10**25, s=[19*AU,0],   v=[0,v_Ura], colour=(0,100,150),   avg_density=1270),
-                    Mass(m=1.024*10**26, s=[30*AU,0],  v=[0,-v_Nep], colour=(0,100,255),   avg_density=1638),]
-    #               Note that velocity vectors are perpendicular to dispalcement (from center of mass) vectors
-    
     # ____________________________Initialising the class so we can instantiate it
 
     def __init__(self):  
@@ -48,24 +27,31 @@ class Main:
         self.screen_width, self.screen_height = 700, 700 
         self.size = (self.screen_width, self.screen_height) 
         self.screen = pygame.display.set_mode(self.size)
-        self.lines = pygame.Surface(self.size)   
         icon = pygame.image.load("Red Dwarf.png")
         pygame.display.set_icon(icon)
+        self.renderer = Renderer(self.screen, self.SPACE_COLOUR)
         self.run = True
-        self.initialise_data_structures(input=self.SOLAR_SYSTEM, center_object_ID=None)  
+        self.initialise_data_structures(input=self.scenario(), center_object_ID=None)  
+        self.apply_units()
         # self.initialise_data_structures()
-        # self.initialise_data_structures(input=self.SOLAR_SYSTEM, center_object_ID=3)
+        # self.initialise_data_structures(input=self.scenario(), center_object_ID=3)
         #  
     def initialise_data_structures(self, input=[], center_object_ID=None):
+        super().initialise_data_structures(input=input, center_object_ID=center_object_ID)
         self.countdown = 0
         self.started = False
         self.drawing = False 
         self.text_x, self.text_y = self.screen_width, self.screen_height/2
-        self.input = input
-        self.center_object_ID = center_object_ID
-        if len(self.input) == 0: self.center_object_ID = None 
-        self.time_elapsed, self.recent_event_log, self.recent_event_times = 0, [], []
+        self.recent_event_log, self.recent_event_times = [], []      # Times in rendered frames
+        self.rendered_frames = 0
         self.mouse_history = []  
+        self.show_profile = self.PROFILE
+        self.trails = None
+        if self.TRAIL_LENGTH > 0: self.trails = Trails(self.TRAIL_LENGTH, self.TRAIL_EVERY, self.SPACE_COLOUR)
+        self.show_trails = True
+        self.overlay, self.overlay_updated = [], 0
+        if self.SEED is None: self.SEED = random.SystemRandom().randrange(2**32)
+        self.rng = random.Random(self.SEED)
 
     # ______________________________________ Consmetics  
     # Customising Caption
@@ -73,8 +59,19 @@ class Main:
         title = "||RED DWARF||"
         title += " "*50
         if years and self.started: title += f"| Time: {round(self.time_elapsed/(365*24*3600),1)} calendar years |"
+        if self.show_profile and self.profiler is not None: title += " " + self.profiler.caption_text()
         pygame.display.set_caption(title)
 
+    #   Profile of recent frames in the top left corner, refreshed twice a second so it
+    #   can be read. P switches it (and the profiler, the first time) on and off.
+    def draw_profile(self):
+        if not self.show_profile or self.profiler is None: return
+        if len(self.overlay) == 0 or time.perf_counter() - self.overlay_updated > 0.5:
+            self.overlay, self.overlay_updated = self.profiler.overlay_lines(), time.perf_counter()
+        for k, line in enumerate(self.overlay):
+            self.renderer.blit_text(line, (10, 10 + 16*k), name="Courier New", size=14,
+                                    antialias=True, colour=(180,255,180), cache=False)
+
     #   Ensuring time updates correctly having retrofitted a screen 
     #   message in draw() method below
     def update_displayed_info(self):
@@ -84,50 +81,33 @@ class Main:
 
     #   Displaying messages and objects on screen
     def draw(self, Model_System):
-        zoom_out = (1/(Mass.distance_unit)) 
-        lines = pygame.Surface(self.size) 
-        lines.fill(self.SPACE_COLOUR)
-        points, radii, colours = [],[],[]
         if not self.drawing:
-            font1 = pygame.font.SysFont("Arial", 36)
-            font2 = pygame.font.SysFont("Cambria", 25)
             text1 = "WHEN THE SCREEN CLEARS . . ."
             text2 = ". . . click on / touch the screen to create new masses."
             coordinates1 = (self.text_x/5, self.text_y -25)
             coordinates2 = (self.text_x/10, self.text_y+25)
-            text_surface1 = font1.render(text1, True, (255,0,0))
-            text_surface2 = font2.render(text2, False, (30,100,255))
-            self.screen.blit(text_surface1,coordinates1)
-            self.screen.blit(text_surface2,coordinates2)
+            self.renderer.blit_text(text1, coordinates1, name="Arial", size=36, antialias=True, colour=(255,0,0))
+            self.renderer.blit_text(text2, coordinates2, name="Cambria", size=25, antialias=False, colour=(30,100,255))
         else:
             center = self.frame_of_reference(Model_System)
-            for n in Model_System.current_system:
-                assert type(n) == Mass
-                screen_coordinates = helper_functions.pygame_array([zoom_out*(n.s[0]-center[0])],
-                                                [zoom_out*(n.s[1]-center[1])], 
-                                                self.screen_width, self.screen_height)[0]
-                points.append(screen_coordinates)
-                n.screen_points = points
-                radii.append(n.dot_diameter)
-                colours.append(n.colour)
-            for n in range(len(points)):
-                pygame.draw.circle(lines,colours[n], points[n], radii[n])
-            self.screen.blit(lines, (0, 0))
+            s, colours, radii = Model_System.render_arrays()
+            trails = self.trails if self.show_trails else None
+            self.renderer.draw_bodies(s, colours, radii, center=center, zoom_out=1/Mass.distance_unit, trails=trails)
+            self.draw_profile()
 
     # __________________________________ Technical / User interaction
-    # Total time elapsed 
+    # Total time elapsed, as far as the physics process has got when it runs separately
     def clock_tick(self, Model):
-        self.time_elapsed+=Model.dT
+        self.rendered_frames += 1
+        if self.BACKGROUND_PHYSICS: self.time_elapsed = Model.time_elapsed
+        else: super().clock_tick(Model)
 
     # Allowing screen/viewer to follow an object
     def frame_of_reference(self, Model_System):
+        center = [0,0]
         if self.center_object_ID is not None and len(self.input)>0:
-            if len(Model_System.new_ids) > 0:
-                index = Model_System.new_ids.index(self.center_object_ID)
-                center = Model_System.current_system[index].s
-            else: 
-                center = self.input[self.center_object_ID].s
-        else: center=[0,0]
+            state = Model_System.body_state(self.center_object_ID)
+            if state is not None: center = state[0]
         return center
     
     # Adding masses to the simulation
@@ -135,6 +115,10 @@ class Main:
         for event in pygame.event.get():
             if event.type == pygame.QUIT: 
                     self.run = False
+            if event.type == KEYDOWN and event.key == K_p and not self.BACKGROUND_PHYSICS:
+                if self.profiler is None: self.profiler = Profiler(self.PHASES)
+                self.show_profile = not self.show_profile
+            if event.type == KEYDOWN and event.key == K_t: self.show_trails = not self.show_trails
             if len(self.recent_event_log) >=2:
                 self.recent_event_log = []
                 self.recent_event_times=[]
@@ -142,11 +126,11 @@ class Main:
                 initial = pygame.mouse.get_pos()
                 self.mouse_history.append(initial)
                 self.recent_event_log.append(initial)
-                self.recent_event_times.append(self.time_elapsed) 
+                self.recent_event_times.append(self.rendered_frames)
             elif event.type == MOUSEBUTTONUP:
                 final = pygame.mouse.get_pos()
                 self.recent_event_log.append(final)
-                self.recent_event_times.append(self.time_elapsed)
+                self.recent_event_times.append(self.rendered_frames)
             # Analysis of gathered data an object creation
             if len(self.recent_event_log) == 2 and self.drawing:
                 event_count = self.mouse_history.count(self.recent_event_log[0])
@@ -160,13 +144,16 @@ class Main:
                     # Adjusting position and velocity with respect to an object's frame of refernce
                     v_x_adjust, v_y_adjust = None,None
                     if self.center_object_ID is not None:
-                        for n in Model_System.current_system:
-                            if n.ID == self.center_object_ID:
-                                s0[0], s0[1] = s0[0]+n.s[0], s0[1]+n.s[1]
-                                s1[0], s1[1] = s1[0]+n.s[0], s1[1]+n.s[1]
-                                v_x_adjust, v_y_adjust = n.v[0], n.v[1]
+                        state = Model_System.body_state(self.center_object_ID)
+                        if state is not None:
+                            center_s, center_v = state
+                            s0[0], s0[1] = s0[0]+center_s[0], s0[1]+center_s[1]
+                            s1[0], s1[1] = s1[0]+center_s[0], s1[1]+center_s[1]
+                            v_x_adjust, v_y_adjust = center_v[0], center_v[1]
                     ds_x, ds_y = s1[0]-s0[0], s1[1]-s0[1]
-                    dt = abs(t1-t0)
+                    # Drag time in rendered frames, each worth the simulated time a foreground
+                    # frame covers, so a throw is as fast whichever process runs the physics
+                    dt = abs(t1-t0)*self.TIME_STEP*self.TIME_LAPSE
                     if dt > 1000: # Must be greater than zero...larger number will reduce velocity magnitude
                         [min_mass, max_mass] = mass_range
                         if len(self.mouse_history) > 20: self.mouse_history = []
@@ -174,39 +161,34 @@ class Main:
                         if max_mass > 10**33: max_mass = 10**33
                         colours = [(255,70,110), (50,100,255), 
                                     (255,255,200)]
-                        colour = random.choice(colours)
-                        m = random.randrange(min_mass, max_mass)
+                        colour = self.rng.choice(colours)
+                        m = float(self.rng.randrange(min_mass, max_mass))
                         vx, vy = ds_x/dt, ds_y/dt
                         if (v_x_adjust and v_y_adjust) is not None:
                             vx+=v_x_adjust
                             vy+=v_y_adjust
                         s, v = s1, [vx, vy]
                         M = Mass(m=m, s=s, v=v, colour=colour, avg_density=1400)
-                        Model_System.current_system.append(M) 
-                    Model_System.combine_removed_masses() 
+                        Model_System.inject(M) 
 
                         
     # Calling the all Gravitation object methods to perform the simulation
     def update_position(self, Model_System):
-        if len(Model_System.current_system) > 0 and self.drawing:
-            Model_System.restrict_system_size(Model_System.current_system) 
-            Model_System.mass_network()
-            Model_System.get_neighbours()
-            Model_System.r_vectors()
-            Model_System.R_mag()
-            Model_System.g_vectors()
-            Model_System.resultant_g()
-            Model_System.calc_velocity()
-            Model_System.reposition()  
-            Model_System.object_locale_data() 
-            Model_System.combine_removed_masses()    
+        if self.BACKGROUND_PHYSICS:
+            if self.drawing: Model_System.run()
+        elif len(Model_System.current_system) > 0 and self.drawing:
+            self.step(Model_System)
+        if self.trails is not None and self.drawing:
+            ids, s, _, _, colours, _ = Model_System.snapshot_arrays()
+            self.trails.update(ids, s, colours, getattr(Model_System, "merges", ()))
         if self.time_elapsed >= self.countdown and self.drawing == False: self.drawing=True
 
     # _______________________________________ Execution___________________________________
     # Executing the simulation via a method containing gaming loop, which 
     # continually reiterates all the above, creating 
     def main(self):
-        Model_System = Gravitation(self) 
+        if self.REPLAY is not None: return self.replay(self.REPLAY)
+        Model_System = PhysicsWorker(self) if self.BACKGROUND_PHYSICS else self.build_model()
         while self.run:     
             self.caption(years=True)    
             self.event_loop(Model_System, mass_range=[10**29,10**30])    
@@ -216,5 +198,46 @@ class Main:
             self.update_displayed_info()
             self.clock_tick(Model_System)
             pygame.display.update()
+        if self.BACKGROUND_PHYSICS: Model_System.stop()
+        else: Model_System.close()
+        if self.PROFILE_EXPORT is not None and self.profiler is not None:
+            self.profiler.export(self.PROFILE_EXPORT)
         pygame.quit()
-Main().main()
\ No newline at end of file
+
+    # Playing back a recorded run without running Gravitation. SPACE pauses, T toggles trails,
+    # LEFT and RIGHT jump back and forward by a hundredth of the run.
+    def replay(self, path):
+        reader = TrajectoryReader(path)
+        k, paused, jump = 0, False, max(len(reader)//100, 1)
+        merges, merged_to = [], -1           # Merges up to frame merged_to, followed by the trails
+        self.started = True
+        while self.run and len(reader) > 0:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT: self.run = False
+                elif event.type == KEYDOWN:
+                    if event.key == K_SPACE: paused = not paused
+                    elif event.key == K_RIGHT: k = min(k + jump, len(reader) - 1)
+                    elif event.key == K_LEFT: k = max(k - jump, 0)
+                    elif event.key == K_t: self.show_trails = not self.show_trails
+                    if event.key in (K_RIGHT, K_LEFT) and self.trails is not None:
+                        self.trails.clear()
+                        merges, merged_to = [], -1
+            self.time_elapsed, rows = reader.frame(k)
+            if self.trails is not None and not paused:
+                if k != merged_to: merges.extend(reader.merges(k) or [])
+                merged_to = k
+                self.trails.update(rows["ID"], rows["s"], rows["colour"], merges)
+            center = [0,0]
+            if self.center_object_ID is not None:
+                found = np.flatnonzero(rows["ID"] == self.center_object_ID)
+                if len(found) > 0: center = rows["s"][found[0]]
+            self.caption(years=True)
+            self.renderer.draw_bodies(rows["s"], rows["colour"], rows["radius"], center=center, 
+                                      zoom_out=1/Mass.distance_unit,
+                                      trails=self.trails if self.show_trails else None)
+            pygame.display.update()
+            if not paused and k < len(reader) - 1: k += 1
+        pygame.quit()
+
+if __name__ == "__main__":
+    Main().main()
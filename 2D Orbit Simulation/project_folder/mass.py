@@ -5,8 +5,9 @@ Instances of the the following Mass class hold all the data
 concerning the their whereabouts"""
 class Mass:
     id=0                    
-    distance_unit = 1       
-    scale = 1000           
+    distance_unit = 1       # Metres per screen unit, set by Simulation.apply_units
+    base_scale = 1000
+    scale = base_scale      # Dot size factor, base_scale*DOT_SCALE once units are applied
     def __init__(self,m=0,s=[0,0],v=[0,0], colour=(255,255,255), avg_density=1000):
         self.ID = Mass.id   
         Mass.id += 1
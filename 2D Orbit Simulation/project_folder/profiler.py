@@ -0,0 +1,123 @@
+import sys
+import csv
+import json
+import time
+from collections import deque
+
+
+"""
+Profiler times every Gravitation method Simulation.step calls and keeps one row per frame:
+the frame time, the time spent in each method, the number of objects, the change in the
+number of memory blocks Python has allocated, and the Gravitation counters (force
+evaluations, pairs of objects whose force was summed, collision checks, candidate and
+colliding pairs, array rebuilds). The totals cover the whole run, the rows the latest
+history frames. Timing costs two perf_counter_ns calls per method, so it is cheap enough to
+leave on; with PROFILE off Simulation.step does not go through it at all. """
+class Profiler:
+
+    def __init__(self, phases, history=10**5, window=60):
+        self.phases = tuple(phases)
+        self.frames = deque(maxlen=history)          # Rows of the latest history frames
+        self.recent = deque(maxlen=window)           # Rows averaged by the overlay
+        self.totals = {name: 0 for name in self.phases}
+        self.counter_totals = {}
+        self.frame_count, self.frame_ns = 0, 0
+        self.current = None
+
+    # ________________________ Collecting
+    # Stands in for the Gravitation instance while a frame is timed
+    def timed(self, Model_System):
+        return TimedModel(self, Model_System)
+
+    def start_frame(self, Model_System):
+        self.current = {name: 0 for name in self.phases}
+        self.counters_before = dict(getattr(Model_System, "counters", {}))
+        self.blocks_before = sys.getallocatedblocks()
+        self.frame_start = time.perf_counter_ns()
+
+    def end_frame(self, time_elapsed, Model_System):
+        frame_ns = time.perf_counter_ns() - self.frame_start
+        counters = getattr(Model_System, "counters", {})
+        row = {"frame": self.frame_count, "time_elapsed": time_elapsed,
+               "bodies": len(Model_System.current_system), "frame_ms": frame_ns/1e6,
+               "allocated_blocks": sys.getallocatedblocks() - self.blocks_before}
+        for name in self.phases:
+            row[name + "_ms"] = self.current[name]/1e6
+            self.totals[name] += self.current[name]
+        for key, value in counters.items():
+            row[key] = value - self.counters_before.get(key, 0)
+            self.counter_totals[key] = self.counter_totals.get(key, 0) + row[key]
+        self.frame_count += 1
+        self.frame_ns += frame_ns
+        self.frames.append(row)
+        self.recent.append(row)
+        self.current = None
+
+    # ________________________ Reporting
+    def summary(self):
+        frames = max(self.frame_count, 1)
+        return {"frames": self.frame_count, "frame_ms": self.frame_ns/1e6/frames,
+                "phase_ms": {name: self.totals[name]/1e6/frames for name in self.phases},
+                "phase_share": {name: self.totals[name]/self.frame_ns if self.frame_ns > 0 else 0
+                                for name in self.phases},
+                "counters": dict(self.counter_totals)}
+
+    # Averages over the latest window frames: one short line for the caption, and the
+    # slowest methods and the counters for the on-screen overlay
+    def caption_text(self):
+        if len(self.recent) == 0: return ""
+        frame_ms = sum([row["frame_ms"] for row in self.recent])/len(self.recent)
+        slowest = max(self.phases, key=lambda name: sum([row[name + "_ms"] for row in self.recent]))
+        share = sum([row[slowest + "_ms"] for row in self.recent])/len(self.recent)/frame_ms if frame_ms > 0 else 0
+        return f"| {frame_ms:.1f} ms/frame, {slowest} {100*share:.0f}% |"
+
+    def overlay_lines(self, count=5):
+        if len(self.recent) == 0: return []
+        n = len(self.recent)
+        mean = lambda key: sum([row.get(key, 0) for row in self.recent])/n
+        lines = ["%.2f ms/frame  %d objects" % (mean("frame_ms"), self.recent[-1]["bodies"])]
+        for name in sorted(self.phases, key=lambda name: -mean(name + "_ms"))[:count]:
+            lines.append("%-22s %7.3f ms" % (name, mean(name + "_ms")))
+        for key in sorted(self.counter_totals):
+            lines.append("%-22s %9.0f" % (key, mean(key)))
+        lines.append("%-22s %9.0f" % ("allocated_blocks", mean("allocated_blocks")))
+        return lines
+
+    # ________________________ Export
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "frames": list(self.frames)}, f, indent=2)
+
+    def to_csv(self, path):
+        columns = []
+        for row in self.frames:
+            for key in row:
+                if key not in columns: columns.append(key)
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval=0)
+            writer.writeheader()
+            writer.writerows(self.frames)
+
+    # CSV for paths ending in .csv, JSON otherwise
+    def export(self, path):
+        if path.lower().endswith(".csv"): self.to_csv(path)
+        else: self.to_json(path)
+
+
+"""
+TimedModel forwards every method call to the Gravitation instance, adding the time it took
+to the profiler's current frame under the method's name. """
+class TimedModel:
+
+    def __init__(self, profiler, Model_System):
+        self.profiler, self.Model_System = profiler, Model_System
+
+    def __getattr__(self, name):
+        method = getattr(self.Model_System, name)
+        current = self.profiler.current
+        def timed(*args):
+            start = time.perf_counter_ns()
+            out = method(*args)
+            current[name] = current.get(name, 0) + time.perf_counter_ns() - start
+            return out
+        return timed
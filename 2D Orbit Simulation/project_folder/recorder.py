@@ -0,0 +1,142 @@
+import os
+import json
+import numpy as np
+
+
+"""
+Recorded runs are stored in a directory:
+
+    meta.json          format version, stride, rows per chunk, rows and frames written
+    frames.bin         one FRAME record per recorded frame: simulated time, first row, row count
+    chunk_00000.bin    BODY records, CHUNK_ROWS per file, memory mapped while written and read
+    merges.bin         one MERGE record per object merged (Gravitation.merges), with the first
+                       recorded frame it is gone from and the ID of the object it became
+
+Every recorded frame stores one row for each object present at that moment, so objects
+appearing (new masses, merges) or disappearing (merges, restrict_system_size) need no special
+handling, the IDs say which is which, and merges.bin says which objects became which. """
+
+FRAME = np.dtype([("time", "<f8"), ("start", "<i8"), ("count", "<i8")])
+BODY = np.dtype([("ID", "<i8"), ("s", "<f8", (2,)), ("v", "<f8", (2,)), ("m", "<f8"),
+                 ("colour", "u1", (3,)), ("radius", "<f4")])
+MERGE = np.dtype([("frame", "<i8"), ("ID", "<i8"), ("new", "<i8")])
+VERSION = 1
+
+
+def chunk_path(path, k):
+    return os.path.join(path, "chunk_%05d.bin" % k)
+
+
+"""
+TrajectoryRecorder appends the state of a Gravitation instance every stride frames. """
+class TrajectoryRecorder:
+
+    def __init__(self, path, stride=1, chunk_rows=2**18):
+        assert stride >= 1 and chunk_rows >= 1
+        os.makedirs(path, exist_ok=True)
+        self.path, self.stride, self.chunk_rows = path, stride, chunk_rows
+        self.rows, self.frames, self.calls, self.merges_seen = 0, 0, 0, 0
+        self.chunk, self.chunk_index = None, -1
+        self.index = open(os.path.join(path, "frames.bin"), "wb")
+        self.merge_log = open(os.path.join(path, "merges.bin"), "wb")
+        self.write_meta()
+
+    def write_meta(self):
+        meta = {"version": VERSION, "stride": self.stride, "chunk_rows": self.chunk_rows,
+                "rows": self.rows, "frames": self.frames}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    # Memory mapped chunk holding the given row, created full size when first needed
+    def chunk_for(self, row):
+        k = row // self.chunk_rows
+        if k != self.chunk_index:
+            if self.chunk is not None: self.chunk.flush()
+            self.chunk = np.memmap(chunk_path(self.path, k), dtype=BODY, mode="w+", shape=(self.chunk_rows,))
+            self.chunk_index = k
+        return self.chunk
+
+    def record(self, time_elapsed, Model_System):
+        self.calls += 1
+        if (self.calls - 1) % self.stride != 0: return
+        ids, s, v, m, colours, radii = Model_System.snapshot_arrays()
+        merges = getattr(Model_System, "merges", [])
+        if len(merges) < self.merges_seen: self.merges_seen = 0
+        for merged, new in merges[self.merges_seen:]:
+            np.array([(self.frames, ID, new) for ID in merged], dtype=MERGE).tofile(self.merge_log)
+        self.merges_seen = len(merges)
+        frame = np.array([(time_elapsed, self.rows, len(ids))], dtype=FRAME)
+        done = 0
+        while done < len(ids):
+            chunk = self.chunk_for(self.rows)
+            first = self.rows % self.chunk_rows
+            n = min(len(ids) - done, self.chunk_rows - first)
+            rows = chunk[first:first+n]
+            rows["ID"], rows["s"], rows["v"] = ids[done:done+n], s[done:done+n], v[done:done+n]
+            rows["m"], rows["colour"], rows["radius"] = m[done:done+n], colours[done:done+n], radii[done:done+n]
+            done += n
+            self.rows += n
+        frame.tofile(self.index)
+        self.frames += 1
+
+    # Flushing the last chunk and trimming it to the rows actually written
+    def close(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+            used = self.rows - self.chunk_index*self.chunk_rows
+            os.truncate(chunk_path(self.path, self.chunk_index), used*BODY.itemsize)
+        self.index.close()
+        self.merge_log.close()
+        self.write_meta()
+
+
+"""
+TrajectoryReader streams frames of a recorded run back from disk. Chunks are memory
+mapped, so only the pages of frames actually read are loaded. """
+class TrajectoryReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        assert self.meta["version"] == VERSION
+        self.chunk_rows = self.meta["chunk_rows"]
+        self.frames = np.fromfile(os.path.join(path, "frames.bin"), dtype=FRAME)
+        merges = os.path.join(path, "merges.bin")     # Not in recordings made before merges were logged
+        self.merge_log = np.fromfile(merges, dtype=MERGE) if os.path.exists(merges) else None
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def chunk(self, k):
+        if k not in self.chunks:
+            self.chunks[k] = np.memmap(chunk_path(self.path, k), dtype=BODY, mode="r")
+        return self.chunks[k]
+
+    # (simulated time, BODY records) of frame k
+    def frame(self, k):
+        start, count = int(self.frames[k]["start"]), int(self.frames[k]["count"])
+        parts = []
+        while count > 0:
+            first = start % self.chunk_rows
+            n = min(count, self.chunk_rows - first)
+            parts.append(self.chunk(start // self.chunk_rows)[first:first+n])
+            start, count = start + n, count - n
+        if len(parts) == 0: rows = np.zeros(0, dtype=BODY)
+        else: rows = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return float(self.frames[k]["time"]), rows
+
+    # Merges in the frames after first up to and including last, as (IDs merged, new ID) in the
+    # form of Gravitation.merges, or None for a recording without them
+    def merges(self, last, first=None):
+        if self.merge_log is None: return None
+        if first is None: first = last - 1
+        log = self.merge_log
+        log = log[(log["frame"] > first) & (log["frame"] <= last)]
+        return [(log["ID"][log["new"] == new].tolist(), int(new)) for new in dict.fromkeys(log["new"].tolist())]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.frame(k)
@@ -0,0 +1,64 @@
+import numpy as np
+import pygame
+import helper_functions
+
+
+"""
+Renderer draws each frame onto one persistent surface instead of allocating a new one per
+frame. Fonts and rendered text are cached, every object's screen position is worked out in
+a single array operation, objects entirely outside the window are skipped, and objects only
+one pixel across are written straight into the surface's pixel array in one go. Only the
+larger objects are drawn with pygame.draw.circle. """
+class Renderer:
+
+    PIXEL_RADIUS = 1.5                    # Dots with a radius below this are drawn as one pixel
+
+    def __init__(self, screen, background=(0,0,0)):
+        self.screen = screen
+        self.width, self.height = screen.get_size()
+        self.background = background
+        self.canvas = pygame.Surface((self.width, self.height), depth=32)
+        self.fonts, self.texts = {}, {}
+        self.points = np.zeros((0,2))     # Screen positions from the latest frame
+
+    # ______________________________________ Cached text
+    def font(self, name, size):
+        if (name, size) not in self.fonts:
+            self.fonts[(name, size)] = pygame.font.SysFont(name, size)
+        return self.fonts[(name, size)]
+
+    def text(self, text, name, size, antialias, colour):
+        key = (text, name, size, antialias, colour)
+        if key not in self.texts:
+            self.texts[key] = self.font(name, size).render(text, antialias, colour)
+        return self.texts[key]
+
+    # Text that changes all the time (cache=False) is rendered afresh, so the cache stays small
+    def blit_text(self, text, coordinates, name="Arial", size=25, antialias=True, colour=(255,255,255), cache=True):
+        if cache: surface = self.text(text, name, size, antialias, colour)
+        else: surface = self.font(name, size).render(text, antialias, colour)
+        self.screen.blit(surface, coordinates)
+
+    # ______________________________________ Objects
+    # s (N x 2) positions, colours (N x 3) and radii (N) of every object, drawn relative to
+    # center and scaled so that 1/zoom_out metres spans half the window, over their trails
+    # if given (see trails.py).
+    def draw_bodies(self, s, colours, radii, center=(0,0), zoom_out=1.0, trails=None):
+        self.canvas.fill(self.background)
+        if trails is not None: trails.draw(self.canvas, center, zoom_out)
+        self.points = helper_functions.pygame_points(zoom_out*(s - np.asarray(center, dtype=float)),
+                                                     self.width, self.height)
+        x, y = self.points[:,0], self.points[:,1]
+        visible = (x + radii >= 0) & (x - radii < self.width) & (y + radii >= 0) & (y - radii < self.height)
+
+        pixel = visible & (radii < self.PIXEL_RADIUS)
+        px, py = x[pixel].astype(np.int64), y[pixel].astype(np.int64)
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        if inside.any():
+            pixels = pygame.surfarray.pixels3d(self.canvas)
+            pixels[px[inside], py[inside]] = colours[pixel][inside]
+            del pixels                     # Unlocks the surface
+
+        for k in np.flatnonzero(visible & ~pixel):
+            pygame.draw.circle(self.canvas, tuple(int(c) for c in colours[k]), (float(x[k]), float(y[k])), float(radii[k]))
+        self.screen.blit(self.canvas, (0, 0))
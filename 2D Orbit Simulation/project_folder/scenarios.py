@@ -0,0 +1,179 @@
+import os
+import gc
+import sys
+import json
+import math
+import time
+import argparse
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+from collisions import candidate_pairs
+
+
+"""
+Input systems, looked up by name in SCENARIOS or read from a scenario file. Every scenario
+returns a new list of Mass instances, so the same scenario can be run any number of times,
+and the generated ones take a seed so a given (n, seed) always gives the same system, with
+GENERATED_N objects unless told otherwise.
+Generated systems stay well inside the region restrict_system_size keeps.
+
+Scenario files are read when they are asked for, never on import. Every file in systems/ is
+registered under its name without the extension, and any other file can be given by path:
+
+    .json / .toml   {"name": ..., "bodies": [{"m": kg, "s": [x, y] AU, "v": [vx, vy] m/s,
+                                               "colour": [r, g, b], "avg_density": kg/m^3}, ...]}
+    .npz            arrays m (N), s (N x 2) in metres, v (N x 2), colours (N x 3), avg_density (N)
+
+The .npz files are the fast path for big generated systems, which take far longer to
+generate than to read back:
+
+    python -m scenarios disk --n 100000 --seed 1 --output systems/disk_100k.npz """
+
+AU, G = Simulation.AU, Simulation.G
+M_SUN = 1.989*10**30
+GENERATED_N = 1000               # Objects in a generated system when no n is given
+CLUSTER_SPACING = 4              # Steps of time_step that stars start apart, at least
+SYSTEMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "systems")
+
+
+# Fresh copies of the masses in a system, with new IDs
+def copy_system(system):
+    return [Mass(m=n.m, s=[float(n.s[0]), float(n.s[1])], v=[float(n.v[0]), float(n.v[1])],
+                 colour=n.colour, avg_density=n.avg_density) for n in system]
+
+# Masses built from whole arrays, with the garbage collector paused: creating 10^5 objects
+# otherwise sets off hundreds of pointless collections
+def system_from_arrays(m, s, v, colours, avg_density):
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return [Mass(m=mi, s=si, v=vi, colour=tuple(c), avg_density=d)
+                for mi, si, vi, c, d in zip(np.asarray(m, dtype=float).tolist(), np.asarray(s, dtype=float).tolist(),
+                                            np.asarray(v, dtype=float).tolist(), np.asarray(colours).tolist(),
+                                            np.asarray(avg_density, dtype=float).tolist())]
+    finally:
+        if collecting: gc.enable()
+
+# A star with n-1 small bodies on circular orbits between r_min and r_max AU, spread
+# evenly in area, all going round the same way
+def random_disk(n=GENERATED_N, seed=0, r_min=0.3, r_max=2.5):
+    rng = np.random.default_rng(seed)
+    system = [Mass(m=M_SUN, s=[0,0], v=[0,0], colour=(255,255,250), avg_density=1408)]
+    k = n - 1
+    r = AU*np.sqrt(rng.uniform(r_min**2, r_max**2, k))
+    phi = rng.uniform(0, 2*math.pi, k)
+    m = 10**rng.uniform(20, 24, k)
+    speed = np.sqrt(G*M_SUN/r)
+    for i in range(k):
+        system.append(Mass(m=float(m[i]), s=[float(r[i]*math.cos(phi[i])), float(r[i]*math.sin(phi[i]))],
+                           v=[float(-speed[i]*math.sin(phi[i])), float(speed[i]*math.cos(phi[i]))],
+                           colour=(200,180,100), avg_density=3000))
+    return system
+
+# n stars sharing total_mass, spread with a Plummer-like profile over a disc of radius
+# AU (as wide as restrict_system_size comfortably keeps, so the stars are not packed solid),
+# and given random velocities of the size needed for the cluster to stay bound. No two
+# stars start close enough to collide within CLUSTER_SPACING steps of time_step seconds (see
+# collisions.py): a star too close to another is placed again.
+def random_cluster(n=GENERATED_N, seed=0, radius=20, total_mass=100*M_SUN, time_step=30000):
+    rng = np.random.default_rng(seed)
+    m = total_mass/n*rng.uniform(0.5, 1.5, n)
+    sigma = math.sqrt(G*m.sum()/(6*radius*AU))
+    v = rng.normal(0, sigma/math.sqrt(2), (n, 2))
+    v -= (m[:,None]*v).sum(axis=0)/m.sum()            # No net momentum
+    diameter = 2*(3*m/(4*math.pi*1408))**(1/3)
+    gap = diameter + CLUSTER_SPACING*np.abs(v).sum(axis=1)*time_step
+    s = np.zeros((n, 2))
+    todo = np.arange(n)
+    for _ in range(100):
+        u = rng.uniform(0, 0.9, len(todo))
+        r = radius*AU*np.sqrt(u/(1 - u))/3
+        phi = rng.uniform(0, 2*math.pi, len(todo))
+        s[todo] = np.column_stack([r*np.cos(phi), r*np.sin(phi)])
+        i, j = candidate_pairs(s, gap)
+        d = s[j] - s[i]
+        close = np.hypot(d[:,0], d[:,1]) <= gap[i] + gap[j]
+        todo = np.unique(np.maximum(i[close], j[close]))
+        if len(todo) == 0: break
+    return system_from_arrays(m, s, v, np.broadcast_to((255,220,180), (n, 3)), np.full(n, 1408.0))
+
+# ________________________ Scenario files
+def system_from_dict(data):
+    bodies = data["bodies"]
+    return system_from_arrays([b["m"] for b in bodies], [[AU*b["s"][0], AU*b["s"][1]] for b in bodies],
+                              [b.get("v", [0, 0]) for b in bodies], [b.get("colour", [255,255,255]) for b in bodies],
+                              [b.get("avg_density", 1000) for b in bodies])
+
+def read_json(path):
+    with open(path) as f:
+        return system_from_dict(json.load(f))
+
+def read_toml(path):
+    try: import tomllib                      # Python 3.11+
+    except ImportError: import tomli as tomllib
+    with open(path, "rb") as f:
+        return system_from_dict(tomllib.load(f))
+
+def read_npz(path):
+    with np.load(path) as data:
+        return system_from_arrays(data["m"], data["s"], data["v"], data["colours"], data["avg_density"])
+
+READERS = {".json": read_json, ".toml": read_toml, ".npz": read_npz}
+
+def read_scenario(path):
+    extension = os.path.splitext(path)[1].lower()
+    assert extension in READERS, "unknown scenario file type " + path
+    return READERS[extension](path)
+
+# A system written to path, as .npz (exact) or .json (positions rounded to AU multiples)
+def write_scenario(path, system, name=None):
+    m = np.array([n.m for n in system], dtype=float)
+    s = np.array([[float(n.s[0]), float(n.s[1])] for n in system], dtype=float).reshape(-1,2)
+    v = np.array([[float(n.v[0]), float(n.v[1])] for n in system], dtype=float).reshape(-1,2)
+    colours = np.array([n.colour for n in system], dtype=np.uint8).reshape(-1,3)
+    avg_density = np.array([n.avg_density for n in system], dtype=float)
+    if path.lower().endswith(".npz"):
+        np.savez(path, m=m, s=s, v=v, colours=colours, avg_density=avg_density)
+        return
+    bodies = [{"m": float(m[k]), "s": (s[k]/AU).tolist(), "v": v[k].tolist(), "colour": colours[k].tolist(),
+               "avg_density": float(avg_density[k])} for k in range(len(system))]
+    with open(path, "w") as f:
+        json.dump({"name": name or os.path.splitext(os.path.basename(path))[0], "bodies": bodies}, f, indent=1)
+
+def file_scenario(path):
+    return lambda n=None, seed=None: read_scenario(path)
+
+# ________________________ Registry
+SCENARIOS = {"disk": random_disk, "cluster": random_cluster}
+if os.path.isdir(SYSTEMS_DIR):
+    for filename in sorted(os.listdir(SYSTEMS_DIR)):
+        name, extension = os.path.splitext(filename)
+        if extension.lower() in READERS: SCENARIOS.setdefault(name, file_scenario(os.path.join(SYSTEMS_DIR, filename)))
+
+# A registered scenario by name, or a scenario file by path
+def load_scenario(name, n=None, seed=0):
+    if name in SCENARIOS: return SCENARIOS[name](GENERATED_N if n is None else n, seed=seed)
+    return read_scenario(name)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a scenario and write it to a scenario file.")
+    parser.add_argument("scenario", nargs="?", default=None, help="name in SCENARIOS or a scenario file")
+    parser.add_argument("--n", type=int, default=None, help="objects in a generated scenario (default: scenarios.GENERATED_N)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help=".npz or .json file to write")
+    parser.add_argument("--list", action="store_true", help="print the registered scenarios")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list or args.scenario is None:
+        for name in sorted(SCENARIOS): print(name)
+        return
+    start = time.perf_counter()
+    system = load_scenario(args.scenario, n=args.n, seed=args.seed)
+    print("%d objects in %.2f s" % (len(system), time.perf_counter() - start), file=sys.stderr)
+    if args.output is not None: write_scenario(args.output, system)
+
+if __name__ == "__main__":
+    main()
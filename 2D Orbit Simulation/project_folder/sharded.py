@@ -0,0 +1,117 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from barnes_hut import QuadTree
+import vector_grav
+
+
+"""
+ShardedForces splits the target bodies of one acceleration evaluation across worker
+processes. Positions, masses, diameters and the target list are copied into shared memory,
+each worker is told which slice of the targets is its shard and writes the accelerations of
+those targets straight into a shared output array, so nothing but a few numbers is pickled
+per evaluation. Every target's acceleration is summed exactly as it would be in one process
+(direct or Barnes-Hut), so results do not depend on the number of workers. With Barnes-Hut
+each worker builds its own quadtree, which takes far less time than walking it. The buffers
+are reallocated, twice as large, when the system outgrows them. """
+
+FIELDS = (("s", np.float64, (2,)), ("m", np.float64, ()), ("diameter", np.float64, ()),
+          ("targets", np.int64, ()), ("a", np.float64, (2,)))
+
+
+# Worker side, the blocks belong to (and are unlinked by) the owner
+def attach(names, capacity):
+    blocks = {field: shared_memory.SharedMemory(name=names[field]) for field, _, _ in FIELDS}
+    arrays = {field: np.ndarray((capacity,) + shape, dtype=dtype, buffer=blocks[field].buf)
+              for field, dtype, shape in FIELDS}
+    return blocks, arrays
+
+# Accelerations of one shard of the targets, written into the shared output array
+def shard_forces(arrays, n, start, end, G, solver, theta, chunk_size):
+    s, m, diameter = arrays["s"][:n], arrays["m"][:n], arrays["diameter"][:n]
+    targets = arrays["targets"][start:end]
+    if solver == "barnes_hut":
+        tree = QuadTree(s, m, diameter)
+        arrays["a"][start:end] = tree.accelerations(G, theta=theta, targets=targets)
+        return tree.interactions
+    arrays["a"][start:end] = vector_grav.direct_accelerations(s, m, diameter, G, targets=targets,
+                                                              chunk_size=chunk_size)
+    return (end - start)*n
+
+# Body of a worker process: ("attach", names, capacity), ("forces", ...) or ("stop",)
+def shard_loop(conn):
+    blocks, arrays = {}, {}
+    while True:
+        message = conn.recv()
+        if message[0] == "stop": break
+        elif message[0] == "attach":
+            arrays = {}
+            for block in blocks.values(): block.close()
+            blocks, arrays = attach(message[1], message[2])
+            conn.send(True)
+        elif message[0] == "forces":
+            conn.send(shard_forces(arrays, *message[1:]))
+    arrays = {}
+    for block in blocks.values(): block.close()
+
+
+class ShardedForces:
+
+    def __init__(self, workers, capacity=0):
+        assert workers >= 2
+        self.capacity, self.blocks, self.arrays = 0, {}, {}
+        self.connections, self.processes = [], []
+        resource_tracker.ensure_running()        # Shared by the workers rather than one each
+        for _ in range(workers):
+            parent, child = mp.Pipe()
+            process = mp.Process(target=shard_loop, args=(child,), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+        if capacity > 0: self.allocate(capacity)
+
+    # New shared buffers for capacity bodies, handed to every worker. The old ones are only
+    # unlinked once every worker has moved over.
+    def allocate(self, capacity):
+        old = self.blocks
+        self.arrays = {}
+        self.capacity = capacity
+        self.blocks = {field: shared_memory.SharedMemory(create=True, size=capacity*np.dtype(dtype).itemsize*int(np.prod(shape)))
+                       for field, dtype, shape in FIELDS}
+        self.arrays = {field: np.ndarray((capacity,) + shape, dtype=dtype, buffer=self.blocks[field].buf)
+                       for field, dtype, shape in FIELDS}
+        names = {field: block.name for field, block in self.blocks.items()}
+        for conn in self.connections: conn.send(("attach", names, capacity))
+        for conn in self.connections: conn.recv()
+        for block in old.values():
+            block.close()
+            block.unlink()
+
+    # Accelerations of the targets (all bodies if None), and the number of pairwise (or
+    # cell) interactions summed to get them
+    def accelerations(self, s, m, diameter, G, targets=None, solver="direct", theta=0.5, chunk_size=1024):
+        n = len(s)
+        if targets is None: targets = np.arange(n)
+        if n > self.capacity: self.allocate(max(n, 2*self.capacity))
+        k = len(targets)
+        self.arrays["s"][:n], self.arrays["m"][:n], self.arrays["diameter"][:n] = s, m, diameter
+        self.arrays["targets"][:k] = targets
+        bounds = np.linspace(0, k, len(self.connections) + 1).astype(np.int64)
+        busy = []
+        for conn, start, end in zip(self.connections, bounds[:-1], bounds[1:]):
+            if end == start: continue
+            conn.send(("forces", n, int(start), int(end), G, solver, theta, chunk_size))
+            busy.append(conn)
+        interactions = sum([conn.recv() for conn in busy])
+        return self.arrays["a"][:k].copy(), interactions
+
+    def close(self):
+        for conn in self.connections: conn.send(("stop",))
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive(): process.terminate()
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks, self.connections, self.processes = {}, [], []
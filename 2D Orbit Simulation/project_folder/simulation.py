@@ -0,0 +1,186 @@
+import time
+from mass import Mass
+from Newtonian_Grav import Gravitation
+from vector_grav import VectorGravitation
+from profiler import Profiler
+from tracers import belt
+from diagnostics import Conservation
+
+
+"""
+Simulation holds everything Gravitation needs from its owner (constants, the input system,
+the elapsed time) without touching pygame. Main extends it with the window, drawing and
+mouse input, while headless runs step it directly for as fast as the physics allows. """
+class Simulation:
+    # _______________________________________Physical Constants
+    AU, G = 1.496*10**11, 6.67430*10**-11    # Average distance between Sun and Earth # Newton's Gravitational Constant
+
+    # _______________________________________ Program constants
+    SCREEN_SCALE = 3                         # Number of AU either side of screen center / origin
+    DOT_SCALE = 1                            # Magnitude of size variation between dots representing objects
+    TIME_LAPSE = 1                           # Rate of evolution| 0 - 1 = 0 to 100% of hardcoded evolution rate
+    ENGINE = "vector"                        # "vector" = NumPy array engine | "classic" = per-Mass list pipeline
+    SOLVER = "direct"                        # Vector engine forces| "direct" = all pairs | "barnes_hut" = quadtree
+    THETA = 0.5                              # Barnes-Hut opening angle| 0 = exact, larger = faster but less accurate
+    TIME_STEP = Gravitation.time_step        # Simulated seconds per rendered frame
+    SUB_STEPS = 1                            # Steps per frame, each advancing TIME_STEP/SUB_STEPS seconds
+    INTEGRATOR = "euler"                     # Vector engine| "euler" | "leapfrog" | "yoshida4" | "rk4" | "block"
+    BLOCK_ETA = 0.03                         # Block timesteps| accuracy factor in eta*sqrt(r_nn/|g|)
+    BLOCK_LEVELS = 10                        # Block timesteps| smallest step is TIME_STEP/SUB_STEPS/2**BLOCK_LEVELS
+    assert SCREEN_SCALE > 0
+    assert DOT_SCALE < 5 and DOT_SCALE >=1
+    assert TIME_LAPSE >= 0 and TIME_LAPSE <=1
+    assert ENGINE in ("vector", "classic")
+    assert SOLVER in ("direct", "barnes_hut") and THETA >= 0
+    assert SUB_STEPS >= 1 and type(SUB_STEPS) == int
+    assert INTEGRATOR in ("euler", "leapfrog", "yoshida4", "rk4", "block")
+    assert BLOCK_ETA > 0 and BLOCK_LEVELS >= 0
+    assert ENGINE == "vector" or INTEGRATOR == "euler"
+    BACKGROUND_PHYSICS = False               # True = Gravitation steps in its own process (see worker.py)
+    WORKERS = 1                              # Vector engine| processes sharing each force evaluation (see sharded.py)
+    assert WORKERS >= 1 and type(WORKERS) == int
+    TRACERS = 0                              # Vector engine| massless tracers in a belt round the heaviest object
+    assert TRACERS >= 0 and (TRACERS == 0 or ENGINE == "vector")
+    PROFILE = False                          # True = time every Gravitation method (see profiler.py)
+    DIAGNOSTICS_EVERY = 0                    # Frames between energy/momentum samples| 0 = off (see diagnostics.py)
+    assert DIAGNOSTICS_EVERY >= 0 and type(DIAGNOSTICS_EVERY) == int
+    SEED = None                              # Seed of the colours and masses of objects added by hand| None = new each run
+    JOURNAL = None                           # File every object added by hand is logged to (see journal.py)
+    SCENARIO = "solar_system"                # Input system when none is given| name in scenarios.SCENARIOS or a file
+    SCENARIO_N = None                        # Objects in a generated SCENARIO| None = scenarios.GENERATED_N
+    SCENARIO_SEED = 0                        # Seed of a generated SCENARIO
+    PHASES = ("restrict_system_size", "mass_network", "get_neighbours", "r_vectors", "R_mag",
+              "g_vectors", "resultant_g", "calc_velocity", "reposition", "object_locale_data",
+              "combine_removed_masses")      # Gravitation methods step calls, in order
+
+    # The input systems (the Solar System by default) are in scenarios.py and systems/
+
+    # ____________________________Initialising the class so we can instantiate it
+    def __init__(self, input=None, center_object_ID=None):
+        self.screen_width, self.screen_height = 700, 700
+        if input is None: input = self.scenario()
+        self.initialise_data_structures(input=input, center_object_ID=center_object_ID)
+        self.apply_units()
+
+    # The SCENARIO system, read when it is first needed rather than on import
+    def scenario(self):
+        from scenarios import load_scenario
+        return load_scenario(self.SCENARIO, n=self.SCENARIO_N, seed=self.SCENARIO_SEED)
+
+    # Screen units of Mass (metres per SCREEN_SCALE AU, dot size) from this instance's
+    # constants, and the dot diameters of the input system in those units
+    def apply_units(self):
+        Mass.distance_unit, Mass.scale = self.SCREEN_SCALE*self.AU, Mass.base_scale*self.DOT_SCALE
+        for n in self.input: n.dot_diameter, n.real_diameter = n.calc_sphere_diam()
+
+    def initialise_data_structures(self, input=[], center_object_ID=None):
+        self.input = input
+        self.center_object_ID = center_object_ID
+        if len(self.input) == 0: self.center_object_ID = None
+        self.time_elapsed, self.frames = 0, 0
+        self.profiler = None
+        self.monitor, self.journal = None, None
+
+    # Program constants (as set on this instance) which another Simulation needs to
+    # reproduce this one, e.g. in a physics process or when restoring a checkpoint
+    def settings(self):
+        return {k: getattr(self, k) for k in dir(Simulation)
+                if k.isupper() and isinstance(getattr(self, k), (int, float, str))}
+
+    # Gravitation engine selected by ENGINE
+    def build_model(self):
+        assert self.ENGINE == "vector" or self.INTEGRATOR == "euler"
+        assert self.TRACERS == 0 or self.ENGINE == "vector"
+        if self.PROFILE and self.profiler is None: self.profiler = Profiler(self.PHASES)
+        if self.DIAGNOSTICS_EVERY > 0 and self.monitor is None:
+            self.monitor = Conservation(self.G, every=self.DIAGNOSTICS_EVERY)
+        if self.JOURNAL is not None and self.journal is None:
+            from journal import Journal
+            self.journal = Journal(self.JOURNAL, self)
+        if self.ENGINE == "classic": Model_System = Gravitation(self)
+        else: Model_System = VectorGravitation(self)
+        if self.TRACERS > 0 and len(self.input) > 0:
+            Model_System.add_tracers(*belt(self.input, self.TRACERS, self.AU, self.G))
+        Model_System.monitor, Model_System.journal = self.monitor, self.journal
+        return Model_System
+
+    # Total time elapsed
+    def clock_tick(self, Model):
+        self.time_elapsed+=Model.frame_dT
+
+    # One frame of the simulation: calling all Gravitation methods in order, SUB_STEPS times,
+    # through the profiler when there is one. On the frames the monitor samples, the sample
+    # is taken straight after the first force evaluation, which then sums the potential too.
+    # When the next frame samples, the last force pass of this one is asked for it instead,
+    # as integrators that end on fresh forces skip that first evaluation.
+    def step(self, Model_System):
+        profiler, monitor = self.profiler, self.monitor
+        sample = monitor is not None and monitor.due()
+        ahead = monitor is not None and monitor.due_next()
+        Model_System.potential_wanted = sample
+        if profiler is not None: profiler.start_frame(Model_System)
+        for k in range(self.SUB_STEPS):
+            if len(Model_System.current_system) == 0: break
+            run = Model_System if profiler is None else profiler.timed(Model_System)
+            run.restrict_system_size(Model_System.current_system)
+            run.mass_network()
+            run.get_neighbours()
+            run.r_vectors()
+            run.R_mag()
+            run.g_vectors()
+            if sample:
+                monitor.sample(self.time_elapsed, Model_System)
+                sample = False
+            Model_System.potential_wanted = ahead and k == self.SUB_STEPS - 1
+            run.resultant_g()
+            run.calc_velocity()
+            run.reposition()
+            run.object_locale_data()
+            run.combine_removed_masses()
+        if profiler is not None: profiler.end_frame(self.time_elapsed, Model_System)
+        self.frames += 1
+
+    # _______________________________________ Headless execution
+    # Stepping without a display until either the step count or the simulated
+    # duration (seconds) is reached, whichever comes first. A recorder and a
+    # checkpointer, if given, are handed every frame (see recorder.py, checkpoint.py),
+    # and a journal player adds its masses before the frames they are due.
+    def simulate(self, steps=None, duration=None, Model_System=None, recorder=None, checkpointer=None,
+                 player=None, analysis=None):
+        assert steps is not None or duration is not None
+        if Model_System is None: Model_System = self.build_model()
+        self.wall_time, self.steps_taken = 0, 0
+        self.bodies_initial = len(Model_System.current_system)
+        start = time.perf_counter()
+        if recorder is not None: recorder.record(self.time_elapsed, Model_System)
+        if analysis is not None: analysis.record(self.time_elapsed, Model_System)
+        while len(Model_System.current_system) > 0:
+            if steps is not None and self.steps_taken >= steps: break
+            if duration is not None and self.time_elapsed >= duration: break
+            if player is not None: player.apply(self, Model_System)
+            self.step(Model_System)
+            self.clock_tick(Model_System)
+            self.steps_taken += 1
+            if recorder is not None: recorder.record(self.time_elapsed, Model_System)
+            if analysis is not None: analysis.record(self.time_elapsed, Model_System)
+            if checkpointer is not None: checkpointer.update(self, Model_System)
+        if checkpointer is not None: checkpointer.save(self, Model_System)
+        self.wall_time = time.perf_counter() - start
+        return Model_System
+
+    # Summary statistics of a finished run
+    def summary(self, Model_System):
+        system = Model_System.current_system
+        total_mass = sum([n.m for n in system])
+        p = [sum([n.m*n.v[j] for n in system]) for j in range(2)]
+        com = [sum([n.m*n.s[j] for n in system])/total_mass if total_mass > 0 else 0 for j in range(2)]
+        profile = self.profiler.summary() if self.profiler is not None else None
+        conservation = self.monitor.summary() if self.monitor is not None else None
+        return {"engine": self.ENGINE, "solver": self.SOLVER, "integrator": self.INTEGRATOR,
+                "dT": Model_System.dT, "sub_steps": self.SUB_STEPS,
+                "steps": self.steps_taken, "time_elapsed": self.time_elapsed,
+                "years": self.time_elapsed/(365*24*3600), "wall_time": self.wall_time,
+                "steps_per_second": self.steps_taken/self.wall_time if self.wall_time > 0 else 0,
+                "bodies_initial": self.bodies_initial, "bodies_final": len(system),
+                "total_mass": float(total_mass), "momentum": [float(n) for n in p],
+                "center_of_mass": [float(n) for n in com], "profile": profile, "conservation": conservation}
@@ -0,0 +1,80 @@
+import json
+import time
+import argparse
+from simulation import Simulation
+from scenarios import load_scenario
+from diagnostics import Conservation
+from Newtonian_Grav import Gravitation
+
+
+"""
+Finding the largest TIME_STEP a scenario can be run at without losing accuracy:
+
+    python -m timestep --scenario solar_system --integrator leapfrog --years 2 --tolerance 1e-6
+
+(from inside project_folder). Starting from --start seconds, the step is doubled for as long
+as a trial run over the same simulated time keeps its largest energy drift (see
+diagnostics.Conservation, which takes merges and ejections out) under the tolerance. Systems
+too big for the energy to be worked out are judged by their angular momentum drift instead.
+The search stops at the first step that fails, or at the largest step the integrator allows. """
+
+YEAR = 365*24*3600
+
+
+# One run of the scenario at time_step, with its largest drifts and speed
+def trial(scenario, time_step, duration, integrator="leapfrog", solver="direct", n=None, seed=0,
+          every=10, energy_limit=20000):
+    sim = Simulation(input=load_scenario(scenario, n=n, seed=seed))
+    sim.INTEGRATOR, sim.SOLVER, sim.TIME_STEP = integrator, solver, time_step
+    sim.monitor = Conservation(sim.G, every=every, energy_limit=energy_limit)
+    Model_System = sim.build_model()
+    sim.simulate(duration=duration, Model_System=Model_System)
+    Model_System.close()
+    summary = sim.monitor.summary()
+    drift = summary["max_energy_drift"]
+    measure = "energy"
+    if drift is None: drift, measure = summary["max_angular_momentum_drift"], "angular_momentum"
+    return {"time_step": time_step, "drift": drift, "measure": measure, "events": summary["events"],
+            "steps": sim.steps_taken, "wall_time": sim.wall_time,
+            "steps_per_second": sim.steps_taken/sim.wall_time if sim.wall_time > 0 else 0}
+
+# The largest safe step found (None if even start fails) and the trial rows behind it
+def safe_time_step(scenario, duration, tolerance=1e-6, start=500, integrator="leapfrog", **options):
+    limit = Gravitation.max_time_step if integrator == "euler" else 10**5    # As VectorGravitation.max_time_step
+    best, rows, time_step = None, [], start
+    while time_step <= limit:
+        row = trial(scenario, time_step, duration, integrator=integrator, **options)
+        row["safe"] = row["drift"] is not None and row["drift"] <= tolerance
+        rows.append(row)
+        print(json.dumps(row))
+        if not row["safe"]: break
+        best, time_step = time_step, 2*time_step
+    return best, rows
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find the largest time step that keeps the drift under a tolerance.")
+    parser.add_argument("--scenario", default=Simulation.SCENARIO, help="name in scenarios.SCENARIOS or a scenario file")
+    parser.add_argument("--n", type=int, default=None, help="objects in a generated scenario (default: scenarios.GENERATED_N)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--integrator", choices=("euler", "leapfrog", "yoshida4", "rk4", "block"), default="leapfrog")
+    parser.add_argument("--solver", choices=("direct", "barnes_hut"), default="direct")
+    parser.add_argument("--years", type=float, default=1, help="simulated years per trial")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="largest relative drift allowed")
+    parser.add_argument("--start", type=float, default=500, help="first time step tried, in seconds")
+    parser.add_argument("--every", type=int, default=10, help="frames between diagnostics samples")
+    parser.add_argument("--energy-limit", type=int, default=20000,
+                        help="largest system whose energy is worked out (all pairs)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    best, rows = safe_time_step(args.scenario, args.years*YEAR, tolerance=args.tolerance, start=args.start,
+                                integrator=args.integrator, solver=args.solver, n=args.n, seed=args.seed,
+                                every=args.every, energy_limit=args.energy_limit)
+    if best is None: print("no safe time step from %g s" % args.start)
+    else: print("largest safe time step: %g s (%d trials, %.1f s)" % (best, len(rows), time.perf_counter() - start))
+    return best
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+
+
+"""
+Tracers are massless test particles (asteroids, ring and debris particles) kept in compact
+arrays rather than as Mass instances. They feel the gravity of every Mass but pull on
+nothing, so a step costs N_massive x N_tracers pair interactions instead of growing with the
+square of the tracer count. A tracer is absorbed, and disappears, when it meets a Mass by the
+same rule remove_collided applies to two masses, with the tracer taken to be a point:
+
+    distance <= 0.5*D + |(|vx1|+|vx2|, |vy1|+|vy2|)|*dT
+
+Tracers have negative IDs, so they can share snapshots and recordings with masses. """
+class Tracers:
+
+    chunk_size = 4096                # Tracers per batch, bounds the (chunk x N_massive) work arrays
+
+    def __init__(self):
+        self.s, self.v, self.g = np.zeros((0,2)), np.zeros((0,2)), np.zeros((0,2))
+        self.colours = np.zeros((0,3), dtype=np.uint8)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.next_id = -1
+        self.g_fresh = False         # True while g matches the current positions of everything
+
+    def __len__(self):
+        return len(self.s)
+
+    def add(self, s, v, colour=(160,160,160)):
+        s, v = np.asarray(s, dtype=float).reshape(-1,2), np.asarray(v, dtype=float).reshape(-1,2)
+        colours = np.broadcast_to(np.asarray(colour, dtype=np.uint8), (len(s), 3))
+        self.s, self.v = np.concatenate([self.s, s]), np.concatenate([self.v, v])
+        self.g = np.concatenate([self.g, np.zeros_like(s)])
+        self.colours = np.concatenate([self.colours, colours])
+        self.ids = np.concatenate([self.ids, self.next_id - np.arange(len(s))])
+        self.next_id -= len(s)
+        self.g_fresh = False
+
+    # Dropping every tracer where keep is False
+    def keep(self, keep):
+        if keep.all(): return
+        self.s, self.v, self.g = self.s[keep], self.v[keep], self.g[keep]
+        self.colours, self.ids = self.colours[keep], self.ids[keep]
+
+    # Acceleration of every tracer due to the masses at positions s_massive. Like
+    # direct_accelerations, a mass exerts no pull on a tracer inside its diameter.
+    def accelerations(self, s_massive, m, diameter, G):
+        a = np.zeros_like(self.s)
+        for start in range(0, len(self.s), self.chunk_size):
+            r = s_massive[None,:,:] - self.s[start:start+self.chunk_size,None,:]
+            dist = np.hypot(r[...,0], r[...,1])
+            w = np.zeros_like(dist)
+            np.divide(G*m[None,:], dist**3, out=w, where=dist > diameter[None,:])
+            a[start:start+len(dist)] = np.einsum('kn,knd->kd', w, r)
+        return a
+
+    # Removing the tracers that meet a mass this step
+    def absorb(self, s_massive, v_massive, diameter, dT):
+        if len(self.s) == 0 or len(s_massive) == 0: return 0
+        hit = np.zeros(len(self.s), dtype=bool)
+        speed = np.abs(v_massive)
+        for start in range(0, len(self.s), self.chunk_size):
+            t = slice(start, start + self.chunk_size)
+            r = s_massive[None,:,:] - self.s[t,None,:]
+            vf = np.abs(self.v[t,None,:]) + speed[None,:,:]
+            LIMIT = 0.5*diameter[None,:] + np.hypot(vf[...,0], vf[...,1])*dT
+            hit[t] = (np.hypot(r[...,0], r[...,1]) <= LIMIT).any(axis=1)
+        self.keep(~hit)
+        return int(hit.sum())
+
+
+# count tracers on circular orbits round the heaviest mass of a system, between r_min and
+# r_max AU from it and spread evenly in area, as (positions, velocities)
+def belt(system, count, AU, G, seed=0, r_min=2.1, r_max=3.3):
+    rng = np.random.default_rng(seed)
+    center = max(system, key=lambda n: n.m)
+    r = AU*np.sqrt(rng.uniform(r_min**2, r_max**2, count))
+    phi = rng.uniform(0, 2*math.pi, count)
+    speed = np.sqrt(G*center.m/r)
+    s = np.column_stack([r*np.cos(phi), r*np.sin(phi)]) + np.asarray(center.s, dtype=float)
+    v = np.column_stack([-speed*np.sin(phi), speed*np.cos(phi)]) + np.asarray(center.v, dtype=float)
+    return s, v
@@ -0,0 +1,94 @@
+import numpy as np
+import pygame
+import helper_functions
+
+
+"""
+Trails keeps the last length positions of every object, sampled every few frames, in one
+fixed size ring buffer per object (slot), so memory and drawing time depend on the buffer
+size and the number of objects, never on how long the simulation has run. All slots are
+sampled at the same moments, so they share one write position. Slots follow object IDs:
+when Gravitation merges a cluster, the new object carries on the longest trail of the
+cluster and the other slots are freed, as they are when an object disappears. Each trail is
+drawn as a few polylines, older parts fading towards the background. Tracers (negative IDs)
+have no trails. """
+class Trails:
+
+    FADE_SEGMENTS = 4                # Polylines per trail, each a step brighter than the one before
+
+    def __init__(self, length=200, every=3, background=(0,0,0)):
+        assert length >= 2 and every >= 1
+        self.length, self.every, self.background = length, every, np.asarray(background, dtype=float)
+        self.points = np.zeros((0, length, 2))
+        self.filled = np.zeros(0, dtype=np.int64)        # Samples held by each slot
+        self.colours = np.zeros((0,3), dtype=np.uint8)
+        self.slots, self.free = {}, []                   # ID -> slot, unused slots
+        self.head, self.frames, self.merges_seen = 0, 0, 0
+
+    def clear(self):
+        self.slots, self.free = {}, list(range(len(self.filled)))
+        self.filled[:] = 0
+
+    def slot_for(self, ID):
+        if ID in self.slots: return self.slots[ID]
+        if len(self.free) == 0:                          # Doubling the number of slots
+            grow = max(len(self.filled), 16)
+            self.free = list(range(len(self.filled), len(self.filled) + grow))
+            self.points = np.concatenate([self.points, np.zeros((grow, self.length, 2))])
+            self.filled = np.concatenate([self.filled, np.zeros(grow, dtype=np.int64)])
+            self.colours = np.concatenate([self.colours, np.zeros((grow,3), dtype=np.uint8)])
+        slot = self.free.pop()
+        self.filled[slot] = 0
+        self.slots[ID] = slot
+        return slot
+
+    # Handing the trails of merged objects on to the objects they became (see Gravitation.merges)
+    def follow_merges(self, merges):
+        for ids, new in merges[self.merges_seen:]:
+            kept = [ID for ID in ids if ID in self.slots]
+            if len(kept) == 0: continue
+            longest = self.slots[max(kept, key=lambda ID: self.filled[self.slots[ID]])]
+            for ID in kept:
+                slot = self.slots.pop(ID)
+                if slot != longest: self.free.append(slot)
+            self.slots[new] = longest
+        self.merges_seen = len(merges)
+
+    # Called once a frame with the IDs, positions and colours of every object
+    def update(self, ids, s, colours, merges=()):
+        if len(merges) < self.merges_seen: self.merges_seen = 0
+        self.follow_merges(merges)
+        self.frames += 1
+        if (self.frames - 1) % self.every != 0: return
+        present = ids >= 0
+        ids, s, colours = ids[present], s[present], colours[present]
+        alive = set(ids.tolist())
+        for ID in [ID for ID in self.slots if ID not in alive]:
+            self.free.append(self.slots.pop(ID))
+        slots = np.array([self.slot_for(ID) for ID in ids.tolist()], dtype=np.int64)
+        if len(slots) == 0: return
+        self.points[slots, self.head] = s
+        self.colours[slots] = colours
+        self.filled[slots] = np.minimum(self.filled[slots] + 1, self.length)
+        self.head = (self.head + 1) % self.length
+
+    # Drawing every trail relative to center, scaled as Renderer.draw_bodies scales objects
+    def draw(self, surface, center=(0,0), zoom_out=1.0):
+        if len(self.slots) == 0: return
+        width, height = surface.get_size()
+        slots = np.array(list(self.slots.values()), dtype=np.int64)
+        slots = slots[self.filled[slots] >= 2]
+        if len(slots) == 0: return
+        world = self.points[slots].reshape(-1,2) - np.asarray(center, dtype=float)
+        screen = helper_functions.pygame_points(zoom_out*world, width, height).reshape(len(slots), self.length, 2)
+        for k, slot in enumerate(slots.tolist()):
+            f = int(self.filled[slot])
+            order = (self.head - f + np.arange(f)) % self.length        # Oldest sample first
+            points = screen[k, order]
+            bounds = np.linspace(0, f - 1, self.FADE_SEGMENTS + 1).astype(np.int64)
+            for j in range(self.FADE_SEGMENTS):
+                if bounds[j+1] <= bounds[j]: continue
+                weight = (j + 1)/self.FADE_SEGMENTS
+                colour = weight*self.colours[slot] + (1 - weight)*self.background
+                pygame.draw.lines(surface, tuple(int(c) for c in colour), False,
+                                  points[bounds[j]:bounds[j+1] + 1].tolist())
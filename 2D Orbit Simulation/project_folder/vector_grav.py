@@ -0,0 +1,303 @@
+import multiprocessing as mp
+import numpy as np
+from Newtonian_Grav import *
+from barnes_hut import QuadTree
+from integrators import INTEGRATORS
+from sharded import ShardedForces
+from tracers import Tracers
+
+
+# Pairwise accelerations on the target bodies due to every other body. Sources closer
+# than the sum of both diameters are ignored, exactly as g_vectors does, which also
+# removes each body's interaction with itself (distance 0). With potential=True the
+# gravitational potential at each target is summed from the same distances, and with
+# nearest=True each target's nearest neighbour distance (as nearest_distances) is taken
+# from them; either way a, phi, nearest are returned, None for what was not asked for.
+def direct_accelerations(s, m, diameter, G, targets=None, chunk_size=1024, potential=False, nearest=False):
+    if targets is None: targets = np.arange(len(s))
+    a = np.zeros((len(targets), 2))
+    phi = np.zeros(len(targets)) if potential else None
+    r_nn = np.full(len(targets), np.inf) if nearest else None
+    for start in range(0, len(targets), chunk_size):
+        t = targets[start:start+chunk_size]
+        r = s[None,:,:] - s[t,None,:]                         # (chunk, N, 2) target -> source
+        dist = np.hypot(r[...,0], r[...,1])
+        outside = dist > diameter[t,None] + diameter[None,:]
+        w = np.zeros_like(dist)
+        np.divide(G*m[None,:], dist**3, out=w, where=outside)
+        a[start:start+len(t)] = np.einsum('kn,knd->kd', w, r)
+        if potential:                                        # Constant inside the cutoff, as in diagnostics.py
+            w = G*m[None,:]/np.maximum(dist, diameter[t,None] + diameter[None,:])
+            w[np.arange(len(t)), t] = 0
+            phi[start:start+len(t)] = -w.sum(axis=1)
+        if nearest:
+            dist[np.arange(len(t)), t] = np.inf
+            r_nn[start:start+len(t)] = dist.min(axis=1)
+    if potential or nearest: return a, phi, r_nn
+    return a
+
+# Distance from each target body to its nearest neighbour, by brute force
+def nearest_distances(s, targets=None, chunk_size=1024):
+    if targets is None: targets = np.arange(len(s))
+    out = np.full(len(targets), np.inf)
+    if len(s) < 2: return out
+    for start in range(0, len(targets), chunk_size):
+        t = targets[start:start+chunk_size]
+        r = s[None,:,:] - s[t,None,:]
+        dist = np.hypot(r[...,0], r[...,1])
+        dist[np.arange(len(t)), t] = np.inf
+        out[start:start+len(t)] = dist.min(axis=1)
+    return out
+
+
+# The coordinates whose locale (the rounded log10 object_locale_data assigns) is beyond
+# bound, |locale| > bound, without taking any logs:
+# |locale| >= k, the first whole number above bound, when |x| >= 10**(k - 0.5) or
+# 0 < |x| <= 10**(0.5 - k) (up to rounding within a few ulps of those limits). The limits
+# only depend on bound, so they are worked out once.
+def locale_limits(bound):
+    k = math.floor(bound) + 1
+    return 10**(0.5 - k), 10**(k - 0.5)
+
+def beyond_locale(s, limits):
+    a = np.abs(s)
+    return (a >= limits[1]) | ((a > 0) & (a <= limits[0]))
+
+
+"""
+VectorGravitation is a drop in replacement for the Gravitation class. Rather than building
+dictionaries of neighbours and nested lists of r, g and gR vectors for every Mass, positions,
+velocities, masses and diameters are kept in contiguous float64 arrays (structure of arrays)
+and all pairwise accelerations are computed in one batched NumPy pass. The s and v attributes
+of each Mass become views onto rows of these arrays, so Main.draw and Main.event_loop keep
+working on Mass instances as before. Main.SOLVER selects exact all-pairs summation ("direct")
+or a Barnes-Hut quadtree ("barnes_hut") with opening angle Main.THETA, and Main.INTEGRATOR
+picks the update rule from integrators.py. With Main.WORKERS above 1 every force evaluation
+is shared between that many processes (see sharded.py). Massless tracers (see tracers.py)
+move in the field of the masses alongside them. """
+class VectorGravitation(Gravitation):
+
+    chunk_size = 1024                # Target bodies per batch, bounds the (chunk x N) work arrays
+
+    # Higher order integrators stay accurate at much larger steps than the Euler update
+    @property
+    def max_time_step(self):
+        if self.main.INTEGRATOR == "euler": return Gravitation.max_time_step
+        return 10**5
+
+    def initialise_data_structures(self):
+        super().initialise_data_structures()
+        self.packed = []
+        self.s, self.v = np.zeros((0,2)), np.zeros((0,2))
+        self.m, self.diameter, self.g = np.zeros(0), np.zeros(0), np.zeros((0,2))
+        self.solver, self.theta = self.main.SOLVER, self.main.THETA
+        assert self.solver in ("direct", "barnes_hut") and self.theta >= 0
+        self.integrator = INTEGRATORS[self.main.INTEGRATOR]
+        self.block_eta, self.block_levels = self.main.BLOCK_ETA, self.main.BLOCK_LEVELS
+        self.g_fresh = False             # True while self.g matches the current positions
+        self.potential = None            # Potential energy from the latest full force pass, if asked for
+        self.nearest_wanted = self.integrator is INTEGRATORS["block"]
+        self.neighbour_distances = None  # Nearest neighbour distances from the latest full force pass, if asked for
+        self.collisions_checked = False  # True while nothing has moved since no collisions were found
+        self.locale_limits = locale_limits(1.1*math.log10(self.main.SCREEN_SCALE*self.main.AU))
+        self.workers, self.sharded = self.main.WORKERS, None
+        self.tracers = Tracers()
+        self.counters["tracers_absorbed"] = 0
+
+    # ________________________ Keeping arrays and Mass instances in step
+    # 1. The arrays are only rebuilt when masses have been added, merged or removed.
+    #    Each Mass then has its s and v rebound to a row of the new arrays.
+    def pack(self):
+        if self.packed == self.current_system: return
+        system = self.current_system
+        self.s = np.array([n.s for n in system], dtype=float).reshape(-1,2)
+        self.v = np.array([n.v for n in system], dtype=float).reshape(-1,2)
+        self.m = np.array([n.m for n in system], dtype=float)
+        self.diameter = np.array([n.real_diameter for n in system], dtype=float)
+        self.colours = np.array([n.colour for n in system], dtype=np.uint8).reshape(-1,3)
+        self.dot_diameter = np.array([n.dot_diameter for n in system], dtype=float)
+        self.ids = np.array([n.ID for n in system], dtype=np.int64)
+        self.g = np.zeros_like(self.s)
+        self.g_fresh = self.tracers.g_fresh = False
+        self.counters["array_rebuilds"] += 1
+        for i, n in enumerate(system):
+            n.s, n.v = self.s[i], self.v[i]
+        self.packed = list(system)
+
+    # ________________________ Methods for calculating object positions
+    # Steps 1-4 of Gravitation (mass_network to R_mag) collapse into packing the arrays,
+    # the neighbour network is implicit in them.
+    def mass_network(self):
+        self.pack()
+
+    def get_neighbours(self): pass
+
+    def r_vectors(self): pass
+
+    def R_mag(self): pass
+
+    # 5./6. Resultant g vector of every object in one pass, at the current positions unless
+    #       trial positions s are given. The quadtree is rebuilt every time it is needed.
+    #       A pass over every object at the current positions also sums the potential
+    #       energy when a diagnostics sample wants it and the direct solver runs here,
+    #       usually the integrator's last pass of the frame before the sample, and keeps
+    #       the nearest neighbour distances the block integrator chooses its levels from.
+    def accelerations(self, targets=None, s=None):
+        current = s is None
+        if s is None: s = self.s
+        self.counters["force_evaluations"] += 1
+        if current: self.potential = self.neighbour_distances = None
+        if self.workers > 1 and not mp.current_process().daemon:    # Daemons cannot start processes
+            if self.sharded is None: self.sharded = ShardedForces(self.workers)
+            a, interactions = self.sharded.accelerations(s, self.m, self.diameter, self.main.G, targets=targets,
+                                                         solver=self.solver, theta=self.theta,
+                                                         chunk_size=self.chunk_size)
+            self.counters["force_pairs"] += interactions
+            return a
+        if self.solver == "barnes_hut":
+            tree = QuadTree(s, self.m, self.diameter)
+            a = tree.accelerations(self.main.G, theta=self.theta, targets=targets)
+            self.counters["force_pairs"] += tree.interactions
+            return a
+        self.counters["force_pairs"] += (len(s) if targets is None else len(targets))*len(s)
+        if current and targets is None and (self.potential_wanted or self.nearest_wanted):
+            a, phi, self.neighbour_distances = direct_accelerations(s, self.m, self.diameter, self.main.G,
+                                                                    chunk_size=self.chunk_size,
+                                                                    potential=self.potential_wanted,
+                                                                    nearest=self.nearest_wanted)
+            if phi is not None: self.potential = 0.5*float((self.m*phi).sum())
+            return a
+        return direct_accelerations(s, self.m, self.diameter, self.main.G,
+                                    targets=targets, chunk_size=self.chunk_size)
+
+    # The force pass only gives the potential energy with the direct solver in this process
+    def potential_from_forces(self):
+        return self.solver == "direct" and (self.workers == 1 or mp.current_process().daemon)
+
+    def pass_potential(self):
+        return self.potential if self.g_fresh else None
+
+    # ________________________ Massless tracers
+    def add_tracers(self, s, v, colour=(160,160,160)):
+        self.tracers.add(s, v, colour)
+
+    def tracer_accelerations(self):
+        self.counters["force_pairs"] += len(self.tracers)*len(self.s)
+        return self.tracers.accelerations(self.s, self.m, self.diameter, self.main.G)
+
+    def close(self):
+        if self.sharded is not None: self.sharded.close()
+        self.sharded = None
+        super().close()
+
+    # Nearest neighbour distance of each object, used to choose block timesteps. The force
+    # pass that left g fresh has usually found them already.
+    def nearest(self, targets=None):
+        if targets is None and self.g_fresh and self.neighbour_distances is not None:
+            return self.neighbour_distances
+        if self.solver == "barnes_hut":
+            return QuadTree(self.s, self.m, self.diameter).nearest(targets=targets)
+        return nearest_distances(self.s, targets=targets, chunk_size=self.chunk_size)
+
+    # Forces at the current positions, evaluated only when they are out of date
+    def fresh_forces(self):
+        if not self.g_fresh: self.g = self.accelerations()
+        self.g_fresh = True
+
+    # Forces left fresh without the potential a sample wants (the monitor attached mid-run)
+    # are evaluated again
+    def g_vectors(self):
+        if self.potential_wanted and self.potential is None and self.potential_from_forces(): self.g_fresh = False
+        self.fresh_forces()
+
+    def resultant_g(self): pass
+
+    # 7. Updating velocities in place so the Mass views see the change. Only the Euler
+    #    update kicks here, before collisions are checked, as Gravitation does.
+    def calc_velocity(self):
+        if self.integrator is INTEGRATORS["euler"]:
+            self.v += self.g*self.dT
+            self.collisions_checked = False
+
+    # 8. Updating positions in place, other integrators advance s and v together here
+    def reposition(self):
+        self.combine_removed_masses()
+        self.pack()
+        tracers = self.tracers
+        if self.integrator is INTEGRATORS["euler"]:
+            if len(tracers) > 0:
+                tracers.v += self.tracer_accelerations()*self.dT
+                tracers.s += tracers.v*self.dT
+            self.s += self.v*self.dT
+            self.g_fresh = False
+        else:
+            self.fresh_forces()
+            if len(tracers) > 0:            # Kick-drift-kick around the masses' own step
+                if not tracers.g_fresh: tracers.g = self.tracer_accelerations()
+                tracers.v += 0.5*self.dT*tracers.g
+                tracers.s += self.dT*tracers.v
+            self.g_fresh = self.integrator(self, self.dT)
+            if len(tracers) > 0:
+                tracers.g = self.tracer_accelerations()
+                tracers.v += 0.5*self.dT*tracers.g
+                tracers.g_fresh = True
+        if len(tracers) > 0:
+            self.counters["tracers_absorbed"] += tracers.absorb(self.s, self.v, self.diameter, self.dT)
+        self.collisions_checked = False
+
+    # 10. Merging colliding masses. step calls this straight after reposition and reposition
+    #     calls it again first thing next step; unless velocities changed in between (Euler)
+    #     or objects came or went, the second check would find nothing new, so it is skipped.
+    def combine_removed_masses(self):
+        if self.collisions_checked and self.packed == self.current_system: return
+        merges = len(self.merges)
+        super().combine_removed_masses()
+        self.collisions_checked = len(self.merges) == merges
+
+    # __________________ Collisions
+    # 9. Collision detection reads the packed arrays directly
+    def collision_arrays(self):
+        self.pack()
+        return self.s, self.v, self.diameter
+
+    # _________________________________ Additional methods for efficiency_________________
+    # Tracers follow the masses, drawn one pixel across and listed with no mass
+    def render_arrays(self):
+        self.pack()
+        t = self.tracers
+        if len(t) == 0: return self.s, self.colours, self.dot_diameter
+        return (np.concatenate([self.s, t.s]), np.concatenate([self.colours, t.colours]),
+                np.concatenate([self.dot_diameter, np.ones(len(t))]))
+
+    def snapshot_arrays(self):
+        self.pack()
+        t = self.tracers
+        if len(t) == 0: return self.ids, self.s, self.v, self.m, self.colours, self.dot_diameter
+        return (np.concatenate([self.ids, t.ids]), np.concatenate([self.s, t.s]), np.concatenate([self.v, t.v]),
+                np.concatenate([self.m, np.zeros(len(t))]), np.concatenate([self.colours, t.colours]),
+                np.concatenate([self.dot_diameter, np.ones(len(t))]))
+
+    # 11 * Locales are only needed by restrict_system_size, which works them out itself
+    def object_locale_data(self): pass
+
+    # 12 ** Same rule as Gravitation.restrict_system_size, applied with one mask and
+    #       without removing items from the list while iterating over it
+    def restrict_system_size(self, system):
+        if system is self.current_system:
+            self.pack()
+            s = self.s
+        else:
+            s = np.array([n.s for n in system], dtype=float).reshape(-1,2)
+        keep = ~beyond_locale(s, self.locale_limits).any(axis=1)
+        if self.monitor is not None and not keep.all():
+            if system is self.current_system:
+                self.monitor.replaced((self.s[~keep], self.v[~keep], self.m[~keep], self.diameter[~keep]),
+                                      (np.zeros((0,2)), np.zeros((0,2)), np.zeros(0), np.zeros(0)),
+                                      (self.s[keep], self.v[keep], self.m[keep], self.diameter[keep]))
+            else:
+                self.monitor.replaced_masses([n for n, k in zip(system, keep) if not k], [],
+                                             [n for n, k in zip(system, keep) if k])
+        if system is self.current_system and len(self.tracers) > 0:
+            self.tracers.keep(~beyond_locale(self.tracers.s, self.locale_limits).any(axis=1))
+        system[:] = [n for n, k in zip(system, keep) if k]
+        return system
@@ -0,0 +1,203 @@
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from mass import Mass
+from simulation import Simulation
+
+
+"""
+SnapshotBuffer is a block of shared memory holding two copies (slots) of everything the
+renderer needs: IDs, positions, velocities, masses, colours and dot sizes of every object, plus the
+simulated time and the length of Gravitation.merges. The physics process always writes into the slot the renderer is not
+reading and then marks it as the latest. Each slot carries a sequence number which is odd
+while the slot is being written, so the renderer can tell if a slot changed under it and
+read it again. A buffer never holds more than its capacity: the physics process moves to a
+bigger buffer when the system outgrows it (see physics_loop). """
+class SnapshotBuffer:
+
+    FIELDS = (("ids", np.int64, ()), ("s", np.float64, (2,)), ("v", np.float64, (2,)),
+              ("m", np.float64, ()), ("colours", np.uint8, (3,)), ("radii", np.float64, ()))
+
+    def __init__(self, capacity, name=None):
+        self.capacity = capacity
+        slot_size = 32 + sum([capacity*np.dtype(t).itemsize*int(np.prod(shape)) for _, t, shape in self.FIELDS])
+        slot_size += -slot_size % 8
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=8 + 2*slot_size)
+        self.name = self.shm.name
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=0)
+        self.slots = []
+        for k in range(2):
+            offset = 8 + k*slot_size
+            slot = {"header": np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf, offset=offset),
+                    "time": np.ndarray((1,), dtype=np.float64, buffer=self.shm.buf, offset=offset + 24)}
+            offset += 32
+            for field, dtype, shape in self.FIELDS:
+                slot[field] = np.ndarray((capacity,) + shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+                offset += slot[field].nbytes
+            self.slots.append(slot)
+        if name is None:
+            self.latest[0] = -1
+            for slot in self.slots: slot["header"][:] = 0
+
+    # Physics side: header = [sequence number, object count, merges logged]
+    def publish(self, time_elapsed, ids, s, v, m, colours, radii, merges=0):
+        k = 1 - self.latest[0] if self.latest[0] >= 0 else 0
+        slot = self.slots[k]
+        count = len(ids)
+        assert count <= self.capacity
+        slot["header"][0] += 1
+        slot["header"][1], slot["header"][2] = count, merges
+        slot["time"][0] = time_elapsed
+        for field, values in zip(("ids", "s", "v", "m", "colours", "radii"), (ids, s, v, m, colours, radii)):
+            slot[field][:count] = values[:count]
+        slot["header"][0] += 1
+        self.latest[0] = k
+
+    # Renderer side: copies of the latest complete snapshot, None before the first one
+    def read(self):
+        while True:
+            k = self.latest[0]
+            if k < 0: return None
+            slot = self.slots[k]
+            seq = slot["header"][0]
+            if seq % 2 == 1: continue
+            count = slot["header"][1]
+            snapshot = {"time": slot["time"][0], "merges": int(slot["header"][2])}
+            for field, _, _ in self.FIELDS:
+                snapshot[field] = slot[field][:count].copy()
+            if slot["header"][0] == seq: return snapshot
+
+    def close(self, unlink=False):
+        self.latest = self.slots = None
+        self.shm.close()
+        if unlink: self.shm.unlink()
+
+
+# Body of the physics process. It waits for "run", then steps the simulation as fast as it
+# can, applying any queued commands ("add" a mass, "stop") between steps. Replies go back to
+# the renderer: the merges logged since the last snapshot, sent before it, and, when the
+# system no longer fits the buffer, the name and capacity of a new buffer twice the size.
+def physics_loop(settings, input, center_object_ID, buffer_name, capacity, commands, replies):
+    Mass.id = max([Mass.id] + [n.ID + 1 for n in input])
+    sim = Simulation(input=input, center_object_ID=center_object_ID)
+    for k, value in settings.items(): setattr(sim, k, value)
+    sim.apply_units()
+    Model_System = sim.build_model()
+    buffer = SnapshotBuffer(capacity, name=buffer_name)
+    buffer = publish(buffer, sim.time_elapsed, Model_System, replies, 0)
+    running, sent = False, len(Model_System.merges)
+    while True:
+        try:
+            while True:
+                command, data = commands.get_nowait()
+                if command == "stop":
+                    Model_System.close()
+                    buffer.close()
+                    return
+                elif command == "run": running = True
+                elif command == "add": Model_System.inject(Mass(**data))
+        except queue.Empty:
+            pass
+        if not running or len(Model_System.current_system) == 0:
+            time.sleep(0.005)
+            continue
+        sim.step(Model_System)
+        sim.clock_tick(Model_System)
+        buffer = publish(buffer, sim.time_elapsed, Model_System, replies, sent)
+        sent = len(Model_System.merges)
+
+# Publishing a snapshot, into a bigger buffer if need be, and returning the buffer used
+def publish(buffer, time_elapsed, Model_System, replies, sent):
+    merges = Model_System.merges
+    if len(merges) > sent: replies.put(("merges", merges[sent:]))
+    arrays = Model_System.snapshot_arrays()
+    if len(arrays[0]) > buffer.capacity:
+        old, buffer = buffer, SnapshotBuffer(2*len(arrays[0]))
+        buffer.publish(time_elapsed, *arrays, merges=len(merges))
+        replies.put(("buffer", (buffer.name, buffer.capacity)))
+        old.close()                  # The renderer unlinks it once it has moved over
+        return buffer
+    buffer.publish(time_elapsed, *arrays, merges=len(merges))
+    return buffer
+
+
+"""
+PhysicsWorker stands in for a Gravitation instance in Main when BACKGROUND_PHYSICS is on.
+Gravitation runs in its own process; the renderer reads the latest complete snapshot from
+shared memory and new masses from event_loop are sent to the physics process through a
+command queue, so neither side waits on the other. Merges come back through the replies
+queue into merges, which mirrors Gravitation.merges for anything following IDs. The buffer starts with room for the input,
+the tracers and HEADROOM more objects, and is replaced by a bigger one as the system grows. """
+class PhysicsWorker:
+
+    HEADROOM = 1024                  # Objects that can be added before the buffer is first replaced
+
+    def __init__(self, main, capacity=None):
+        if capacity is None: capacity = len(main.input) + main.TRACERS + self.HEADROOM
+        self.buffer = SnapshotBuffer(capacity)
+        self.commands, self.replies = mp.Queue(), mp.Queue()
+        self.running, self.merges = False, []
+        self.snapshot = {"time": 0.0, "merges": 0, "ids": np.zeros(0, dtype=np.int64), "s": np.zeros((0,2)),
+                         "v": np.zeros((0,2)), "m": np.zeros(0), "colours": np.zeros((0,3), dtype=np.uint8),
+                         "radii": np.zeros(0)}
+        self.process = mp.Process(target=physics_loop, daemon=True,
+                                  args=(main.settings(), list(main.input), main.center_object_ID,
+                                        self.buffer.name, capacity, self.commands, self.replies))
+        self.process.start()
+
+    # Handling one reply, False if none came within timeout seconds (None = not waiting)
+    def receive(self, timeout=None):
+        try:
+            kind, data = self.replies.get(timeout=timeout) if timeout is not None else self.replies.get_nowait()
+        except queue.Empty:
+            return False
+        if kind == "merges": self.merges.extend(data)
+        elif kind == "buffer":       # Moving over to the buffer the physics process grew into
+            self.buffer.close(unlink=True)
+            self.buffer = SnapshotBuffer(data[1], name=data[0])
+        return True
+
+    # The latest snapshot, once every merge logged before it has arrived
+    def latest(self):
+        while self.receive(): pass
+        snapshot = self.buffer.read()
+        if snapshot is not None:
+            while len(self.merges) < snapshot["merges"] and self.receive(timeout=1): pass
+            self.snapshot = snapshot
+        return self.snapshot
+
+    @property
+    def time_elapsed(self):
+        return self.snapshot["time"]
+
+    def run(self):
+        if not self.running: self.commands.put(("run", None))
+        self.running = True
+
+    # ____________________ Same interface Main uses on Gravitation
+    def render_arrays(self):
+        snapshot = self.latest()
+        return snapshot["s"], snapshot["colours"], snapshot["radii"]
+
+    def snapshot_arrays(self):
+        snapshot = self.latest()
+        return (snapshot["ids"], snapshot["s"], snapshot["v"], snapshot["m"], snapshot["colours"],
+                snapshot["radii"])
+
+    def body_state(self, ID):
+        found = np.flatnonzero(self.snapshot["ids"] == ID)
+        if len(found) == 0: return None
+        return self.snapshot["s"][found[0]], self.snapshot["v"][found[0]]
+
+    def inject(self, M):
+        self.commands.put(("add", {"m": M.m, "s": [float(n) for n in M.s], "v": [float(n) for n in M.v],
+                                   "colour": M.colour, "avg_density": M.avg_density}))
+
+    def stop(self):
+        self.commands.put(("stop", None))
+        self.process.join(timeout=5)
+        if self.process.is_alive(): self.process.terminate()
+        self.latest()                # Unlinking any buffer the renderer had not moved over to yet
+        self.buffer.close(unlink=True)